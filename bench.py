@@ -0,0 +1,633 @@
+#!/usr/bin/env python3
+"""Бенчмарки производительности ботов
+
+Запуск: python3 bench.py <сценарий> [параметры]
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import sys
+import time
+
+SAMPLE_SIGNATURE = {
+    'document_hash': '3f2a9c1e5b7d4f6a8c0e2b4d6f8a0c2e',
+    'lawyer_signed': True,
+    'lawyer_name': 'Иванов Иван Иванович',
+    'lawyer_sign_date': '01.10.2026 12:00:00',
+    'client_signed': True,
+    'client_name': 'Петров Петр Петрович',
+    'client_sign_date': '02.10.2026 15:30:00',
+}
+
+def _rate(func, count):
+    """Возвращает число вызовов func в секунду"""
+    func()  # прогрев
+    started = time.perf_counter()
+    for _ in range(count):
+        func()
+    return count / (time.perf_counter() - started)
+
+def bench_stamp(args):
+    """Штампов в секунду: с повторным разбором TTF на каждый штамп и с кешем шрифтов"""
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    import pdf_stamp
+
+    def uncached():
+        # Так работал create_signature_stamp до кеширования шрифтов
+        for font_name, font_path in pdf_stamp.FONT_FILES.items():
+            pdfmetrics.registerFont(TTFont(font_name, font_path))
+        pdf_stamp.create_signature_stamp(SAMPLE_SIGNATURE)
+
+    def cached():
+        pdf_stamp.create_signature_stamp(SAMPLE_SIGNATURE)
+
+    before = _rate(uncached, args.count)
+    after = _rate(cached, args.count)
+    print(f"Штампов/с без кеша шрифтов: {before:.1f}")
+    print(f"Штампов/с с кешем шрифтов:  {after:.1f}")
+    print(f"Ускорение: x{after / before:.1f}")
+
+def bench_email(args):
+    """Писем в секунду: сборка MIMEMultipart на каждое письмо и заготовка из email_templates"""
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+    import email_templates
+
+    name = SAMPLE_SIGNATURE['client_name']
+
+    def uncached():
+        # Так собирал письмо send_email до появления шаблонов
+        message = MIMEMultipart()
+        message['From'] = email_templates.SENDER
+        message['To'] = 'client@example.com'
+        message['Subject'] = email_templates.SUBJECT
+        body = email_templates.TEMPLATES['client_code'].format(code='AB12CD', name=name)
+        message.attach(MIMEText(body, 'plain', 'utf-8'))
+        message.as_bytes()
+
+    def cached():
+        email_templates.build_code_email('client', 'client@example.com', 'AB12CD', name)
+
+    before = _rate(uncached, args.count)
+    after = _rate(cached, args.count)
+    print(f"Писем/с с MIMEMultipart: {before:.0f} ({1e6 / before:.1f} мкс на письмо)")
+    print(f"Писем/с с заготовкой:    {after:.0f} ({1e6 / after:.1f} мкс на письмо)")
+    print(f"Ускорение: x{after / before:.1f}")
+
+def _percentile(values, percent):
+    """Перцентиль по отсортированному списку"""
+    index = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+    return values[index]
+
+def bench_mail(args):
+    """Задержка доставки кода и пропускная способность через локальный smtp_sink
+
+    direct - как было до очереди: новое SMTP-соединение на каждое письмо
+    прямо в обработчике (event loop блокируется на время отправки);
+    queue - очередь outbox, пул SMTP-сессий и ограничитель скорости.
+    """
+    import asyncio
+    import os
+    import smtplib
+    import tempfile
+    import db
+    import email_templates
+    from mail_queue import MailQueue
+    from rate_limiter import SendLimiter
+    from smtp_pool import SMTPPool
+    from smtp_sink import SMTPSink
+
+    sink = SMTPSink(latency=args.latency, fail_rate=args.fail_rate)
+    sink.start_in_thread()
+    name = SAMPLE_SIGNATURE['client_name']
+    domains = [f"provider{i}.example" for i in range(args.domains)]
+
+    def recipient(flow):
+        return f"flow{flow}@{domains[flow % len(domains)]}"
+
+    def direct_send(to_email):
+        # Так работал send_email до очереди писем
+        data = email_templates.build_code_email('client', to_email, 'AB12CD', name)
+        with smtplib.SMTP('127.0.0.1', sink.port) as server:
+            server.login('bench', 'bench')
+            server.sendmail(email_templates.SENDER, [to_email], data)
+
+    async def run_direct():
+        async def flow(number):
+            direct_send(recipient(number))
+        await asyncio.gather(*(flow(number) for number in range(args.flows)))
+
+    async def run_queue():
+        pool = SMTPPool('127.0.0.1', sink.port, 'bench', 'bench', size=args.pool, starttls=False)
+        limiter = SendLimiter(args.rate, args.rate, args.rate, args.rate)
+        queue = MailQueue('client', send_batch=pool.send_batch, limiter=limiter,
+                          workers=args.workers, retry_base=0.05, poll_interval=0.05)
+        failed = []
+
+        async def on_failure(chat_id, document_id, to_email):
+            failed.append(to_email)
+        await queue.start(on_failure)
+
+        async def flow(number):
+            await queue.enqueue(number, number, recipient(number), 'AB12CD', name)
+        await asyncio.gather(*(flow(number) for number in range(args.flows)))
+
+        while len(sink.messages) + len(failed) < args.flows:
+            await asyncio.sleep(0.01)
+        await queue.stop()
+        pool.close()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = os.path.join(tmp, 'bench.db')
+        db.init_database()
+
+        for path, run in (('direct', run_direct), ('queue', run_queue)):
+            if args.path not in ('all', path):
+                continue
+            sink.messages.clear()
+            started = time.monotonic()
+            asyncio.run(run())
+            db.shutdown()
+
+            latencies = sorted(received - started for received, *_ in sink.messages)
+            elapsed = max(latencies)
+            print(f"{path}: {len(latencies)} писем за {elapsed:.2f} с, {len(latencies) / elapsed:.1f} писем/с")
+            print(f"  задержка доставки p50 {_percentile(latencies, 50) * 1000:.0f} мс, "
+                  f"p95 {_percentile(latencies, 95) * 1000:.0f} мс, "
+                  f"p99 {_percentile(latencies, 99) * 1000:.0f} мс")
+
+    sink.stop_thread()
+
+class _FakeBotAPI:
+    """Заглушка Bot API: отдает записанные обновления через getUpdates и запоминает ответы бота"""
+
+    def __init__(self):
+        import asyncio
+        self.updates = []
+        self.new_updates = asyncio.Event()
+        self.stopping = False
+        self.replies = {}     # текст ответа -> время получения
+        self.chats = {}       # id чата -> тексты ответов по порядку
+        self.answered = {}    # id чата -> время первого ответа
+
+    @staticmethod
+    def make_update(number, user_id=None, text=None):
+        """Обновление с текстовым сообщением, как его присылает Telegram"""
+        user = {'id': user_id or 1000 + number, 'is_bot': False, 'first_name': 'Bench'}
+        return {
+            'update_id': number,
+            'message': {
+                'message_id': number,
+                'date': int(time.time()),
+                'chat': {'id': user['id'], 'type': 'private'},
+                'from': user,
+                'text': text or f"ping {number}",
+            },
+        }
+
+    def push(self, update):
+        self.updates.append(update)
+        self.new_updates.set()
+
+    async def handle(self, method, path, headers, body):
+        import asyncio
+        import json
+        from urllib.parse import parse_qs
+
+        api_method = path.rpartition('/')[2]
+        params = {name: values[0] for name, values in parse_qs(body.decode()).items()}
+
+        if api_method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        elif api_method == 'getUpdates':
+            offset = int(params.get('offset', 0))
+            deadline = time.monotonic() + float(params.get('timeout', 0))
+            while not self.stopping:
+                result = [update for update in self.updates if update['update_id'] >= offset]
+                if result or time.monotonic() >= deadline:
+                    break
+                self.new_updates.clear()
+                try:
+                    await asyncio.wait_for(self.new_updates.wait(), deadline - time.monotonic())
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                result = []
+            self.updates = [update for update in self.updates if update['update_id'] >= offset]
+        elif api_method == 'sendMessage':
+            self.replies[params['text']] = time.monotonic()
+            self.chats.setdefault(int(params['chat_id']), []).append(params['text'])
+            self.answered.setdefault(int(params['chat_id']), time.monotonic())
+            chat = {'id': int(params['chat_id']), 'type': 'private'}
+            result = {'message_id': len(self.replies), 'date': int(time.time()), 'chat': chat,
+                      'text': params['text']}
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode(), 'application/json'
+
+def _bench_email(number):
+    """Email клиента, от имени которого приходит обновление number"""
+    return f"client{number}@bench.example"
+
+def _seed_clients(cursor, numbers):
+    """Клиенты для обновлений numbers; их пользователи ждут ввода email в боте клиента"""
+    from client_bot import EMAIL_VERIFICATION
+    import db
+
+    items = []
+    for number in numbers:
+        user_id = 1000 + number
+        db.upsert_client(cursor, _bench_email(number), f"Клиент {number}")
+        items.append(('conversation:email_verification', json.dumps([user_id, user_id]),
+                      json.dumps(EMAIL_VERIFICATION)))
+    db.save_persistence(cursor, 'client', items)
+
+def _push_updates(url, secret, first, count, connections, interval, results):
+    """Отправляет count обновлений, начиная с first, не более чем по connections соединениям
+
+    interval - пауза между обновлениями (0 - все сразу). Выполняется в
+    отдельном процессе; время отправки по id чата (time.monotonic общее
+    для процессов) возвращается через очередь results.
+    """
+    import asyncio
+    import httpx
+    import webhook
+
+    async def post_all():
+        sent = {}
+        limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+        async with httpx.AsyncClient(limits=limits) as client:
+            async def post(number):
+                sent[1000 + number] = time.monotonic()
+                update = _FakeBotAPI.make_update(number, text=_bench_email(number))
+                response = await client.post(url, json=update, headers={webhook.SECRET_HEADER: secret})
+                response.raise_for_status()
+            posts = []
+            for number in range(first, first + count):
+                posts.append(asyncio.create_task(post(number)))
+                if interval:
+                    await asyncio.sleep(interval)
+            await asyncio.gather(*posts)
+        return sent
+
+    results.put(asyncio.run(post_all()))
+
+def bench_webhook(args):
+    """Задержка обработки обновлений: run_polling против webhook на заглушке Bot API
+
+    Обновления проходят через обработчики, persistence и обработчик
+    параллельных обновлений бота клиента: каждый пользователь вводит email,
+    бот ищет клиента и его документы во временной базе.
+    """
+    import asyncio
+    import os
+    import tempfile
+    from telegram.ext import Application
+    import client_bot
+    import db
+    import webhook
+
+    secret = 'bench-secret'
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    # Бот настраивает журнал при импорте; в замере он только мешает
+    logging.getLogger().setLevel(logging.WARNING)
+    db.DB_PATH = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    db.init_database()
+    # У каждого режима свои пользователи: диалог после ответа завершается, а кеш клиентов прогрет
+    db.write(_seed_clients, range(1, 2 * args.updates + 1))
+
+    async def run(mode, first):
+        api = _FakeBotAPI()
+        api_server = webhook.HTTPServer(api.handle)
+        await api_server.start()
+
+        # Обработчики бота, но запросы идут в заглушку Bot API
+        bot_application = client_bot.build_application()
+        application = (Application.builder().token('1:bench')
+                       .base_url(f"http://127.0.0.1:{api_server.port}/bot")
+                       .concurrent_updates(bot_application.update_processor)
+                       .persistence(bot_application.persistence)
+                       .build())
+        for group, handlers in bot_application.handlers.items():
+            application.add_handlers(handlers, group)
+        await application.initialize()
+        await application.start()
+
+        sent = {}
+        if mode == 'polling':
+            await application.updater.start_polling(poll_interval=0, timeout=10)
+            for number in range(first, first + args.updates):
+                sent[1000 + number] = time.monotonic()
+                api.push(_FakeBotAPI.make_update(number, text=_bench_email(number)))
+                if args.interval:
+                    await asyncio.sleep(args.interval)
+        else:
+            server = webhook.WebhookServer({'client': application}, secret, '127.0.0.1', 0)
+            await server.start()
+            url = f"http://127.0.0.1:{server.http.port}/client"
+            # Обновления присылает отдельный процесс, как Telegram
+            context = multiprocessing.get_context('spawn')
+            results = context.Queue()
+            pusher = context.Process(target=_push_updates,
+                                     args=(url, secret, first, args.updates, args.connections,
+                                           args.interval, results))
+            pusher.start()
+            sent = await asyncio.to_thread(results.get)
+            pusher.join()
+
+        while len(api.answered) < args.updates:
+            await asyncio.sleep(0.005)
+
+        api.stopping = True
+        api.new_updates.set()
+        if mode == 'polling':
+            await application.updater.stop()
+        else:
+            await server.stop()
+        await application.stop()
+        await application.shutdown()
+        await api_server.stop()
+
+        unknown = sum(not texts[0].startswith("✅") for texts in api.chats.values())
+        if unknown:
+            print(f"{mode}: {unknown} ответов не из диалога ввода email")
+        started = min(sent.values())
+        latencies = sorted(api.answered[chat_id] - sent[chat_id] for chat_id in sent)
+        elapsed = max(api.answered.values()) - started
+        print(f"{mode}: {args.updates} обновлений за {elapsed:.2f} с, {args.updates / elapsed:.0f} обновлений/с")
+        print(f"  задержка ответа p50 {_percentile(latencies, 50) * 1000:.1f} мс, "
+              f"p95 {_percentile(latencies, 95) * 1000:.1f} мс, "
+              f"p99 {_percentile(latencies, 99) * 1000:.1f} мс")
+
+    try:
+        for first, mode in ((1, 'polling'), (args.updates + 1, 'webhook')):
+            asyncio.run(run(mode, first))
+    finally:
+        db.shutdown()
+
+def bench_concurrency(args):
+    """Пропускная способность при последовательной и параллельной обработке обновлений
+
+    Обработчик ждет --work секунд (как ожидание штампа или SMTP) и отвечает.
+    Проверяется, что ответы каждому пользователю идут в порядке его сообщений.
+    Второй сценарий: один пользователь присылает --burst сообщений подряд,
+    затем остальные по одному; их ответы не должны ждать всей очереди первого.
+    """
+    import asyncio
+    from telegram.ext import Application, MessageHandler, filters
+    from update_processor import PerUserUpdateProcessor
+    import webhook
+
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    async def handle(update, context):
+        # Порядок сообщений одного пользователя должен сохраняться
+        context.user_data.setdefault('seen', []).append(update.message.message_id)
+        await asyncio.sleep(args.work)
+        await update.message.reply_text(update.message.text)
+
+    async def run(concurrency, users):
+        """Отправляет сообщения [(номер, id пользователя)] и возвращает заглушку API и время отправки"""
+        api = _FakeBotAPI()
+        api_server = webhook.HTTPServer(api.handle)
+        await api_server.start()
+
+        builder = Application.builder().token('1:bench').base_url(f"http://127.0.0.1:{api_server.port}/bot")
+        if concurrency:
+            builder = builder.concurrent_updates(PerUserUpdateProcessor(concurrency))
+        application = builder.build()
+        application.add_handler(MessageHandler(filters.TEXT, handle))
+        await application.initialize()
+        await application.start()
+        await application.updater.start_polling(poll_interval=0, timeout=10)
+
+        started = time.monotonic()
+        for number, user_id in enumerate(users, 1):
+            api.push(_FakeBotAPI.make_update(number, user_id=user_id))
+        while len(api.replies) < len(users):
+            await asyncio.sleep(0.005)
+
+        api.stopping = True
+        api.new_updates.set()
+        await application.updater.stop()
+        await application.stop()
+        await application.shutdown()
+        await api_server.stop()
+        return api, started
+
+    def label(concurrency):
+        return f"параллельно ({concurrency})" if concurrency else "последовательно"
+
+    async def throughput(concurrency):
+        total = args.users * args.messages
+        api, started = await run(concurrency, [1 + number % args.users for number in range(1, total + 1)])
+        elapsed = max(api.replies.values()) - started
+        ordered = all(texts == sorted(texts, key=lambda text: int(text.split()[1]))
+                      for texts in api.chats.values())
+        print(f"{label(concurrency)}: {total / elapsed:.1f} обновлений/с, порядок по пользователям "
+              f"{'сохранен' if ordered else 'НАРУШЕН'}")
+
+    async def burst(concurrency):
+        others = min(args.users - 1, concurrency) or 1
+        api, started = await run(concurrency, [1] * args.burst + list(range(2, 2 + others)))
+        waits = sorted(api.replies[f"ping {number}"] - started
+                       for number in range(args.burst + 1, args.burst + 1 + others))
+        burst_done = max(api.replies[f"ping {number}"] for number in range(1, args.burst + 1)) - started
+        print(f"{label(concurrency)}: {args.burst} сообщений одного пользователя за {burst_done:.2f} с, "
+              f"остальные {others} ответили через {waits[0]:.2f}-{waits[-1]:.2f} с")
+
+    print(f"{args.users} пользователей по {args.messages} сообщения:")
+    for concurrency in [0] + args.concurrency:
+        asyncio.run(throughput(concurrency))
+    print(f"Очередь одного пользователя из {args.burst} сообщений:")
+    for concurrency in [0] + args.concurrency:
+        asyncio.run(burst(concurrency))
+
+def _startup_child(module_name, eager, started, results):
+    """Запускает бота в отдельном процессе и замеряет импорт, память и первый ответ"""
+    import asyncio
+    import importlib
+    import os
+    import resource
+    import tempfile
+    from resources import LAZY_MODULES
+
+    began = time.perf_counter()
+    if eager:
+        # Как до отложенной загрузки: модули PDF и почты импортируются при запуске
+        for name in LAZY_MODULES:
+            importlib.import_module(name)
+    bot_module = importlib.import_module(module_name)
+    import_time = time.perf_counter() - began
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    from telegram.ext import Application
+    import db
+    import run_bots
+    import webhook
+
+    # Отдельная база: persistence бота читает ее при запуске
+    db.DB_PATH = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    db.init_database()
+
+    # Боты настраивают журнал при импорте; в замере он только мешает
+    logging.getLogger().setLevel(logging.WARNING)
+
+    async def run():
+        api = _FakeBotAPI()
+        api_server = webhook.HTTPServer(api.handle)
+        await api_server.start()
+
+        # Обработчики и persistence бота, но запросы идут в заглушку Bot API
+        bot_application = bot_module.build_application()
+        application = (
+            Application.builder()
+            .token('1:bench')
+            .base_url(f"http://127.0.0.1:{api_server.port}/bot")
+            .persistence(bot_application.persistence)
+            .build()
+        )
+        for group, handlers in bot_application.handlers.items():
+            application.add_handlers(handlers, group)
+
+        update = _FakeBotAPI.make_update(1)
+        update['message']['text'] = '/start'
+        update['message']['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': 6}]
+        api.push(update)
+
+        stop_event = asyncio.Event()
+        runner = asyncio.create_task(run_bots.run_polling({module_name: application}, stop_event))
+        while not api.replies:
+            await asyncio.sleep(0.001)
+        first_update = time.time() - started
+
+        api.stopping = True
+        api.new_updates.set()
+        stop_event.set()
+        await runner
+        await api_server.stop()
+        return first_update
+
+    try:
+        results.put((import_time, rss, asyncio.run(run())))
+    finally:
+        db.shutdown()
+
+def bench_startup(args):
+    """Холодный запуск бота: время импорта, RSS после импорта и время до первого ответа
+
+    Сравнивается загрузка модулей PDF и почты при запуске (как раньше)
+    и отложенная загрузка. Каждый замер - в новом процессе.
+    """
+    context = multiprocessing.get_context('spawn')
+    for module_name in args.bots:
+        for eager in (True, False):
+            imports, rss, first = [], [], []
+            for _ in range(args.runs):
+                results = context.Queue()
+                process = context.Process(target=_startup_child,
+                                          args=(module_name, eager, time.time(), results))
+                process.start()
+                import_time, rss_mb, first_update = results.get(timeout=120)
+                process.join()
+                imports.append(import_time)
+                rss.append(rss_mb)
+                first.append(first_update)
+
+            label = "сразу" if eager else "отложенно"
+            print(f"{module_name}, PDF и почта {label}: импорт {sorted(imports)[len(imports) // 2] * 1000:.0f} мс, "
+                  f"RSS {sorted(rss)[len(rss) // 2]:.1f} МБ, "
+                  f"первый ответ через {sorted(first)[len(first) // 2] * 1000:.0f} мс после старта процесса")
+
+def bench_plans(args):
+    """Планы частых запросов; завершается с кодом 1, если какой-то запрос читает всю таблицу
+
+    По умолчанию схема создается во временной базе. Базу из --db открывает
+    только для чтения и не мигрирует: планы строятся по ее текущей схеме.
+    """
+    import os
+    import sqlite3
+    import tempfile
+    import db
+
+    if args.db:
+        conn = sqlite3.connect(f"file:{args.db}?mode=ro", uri=True)
+    else:
+        db.DB_PATH = os.path.join(tempfile.mkdtemp(), 'bench.db')
+        db.init_database()
+        conn = db.get_connection()
+
+    try:
+        plans = db.explain_hot_queries(conn.cursor())
+    except sqlite3.OperationalError as e:
+        sys.exit(f"Не удалось построить планы: {e} (схема базы не обновлена?)")
+
+    full_scans = 0
+    for name, plan in plans.items():
+        print(name)
+        for detail in plan:
+            scan = db.is_full_scan(detail)
+            full_scans += scan
+            print(f"  {'!!' if scan else 'ok'} {detail}")
+
+    print(f"Полных просмотров: {full_scans}")
+    if full_scans:
+        sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки ботов документооборота")
+    subparsers = parser.add_subparsers(dest='scenario', required=True)
+
+    stamp_parser = subparsers.add_parser('stamp', help="Скорость генерации штампа")
+    stamp_parser.add_argument('--count', type=int, default=50)
+    stamp_parser.set_defaults(func=bench_stamp)
+
+    email_parser = subparsers.add_parser('email', help="Стоимость сборки письма с кодом")
+    email_parser.add_argument('--count', type=int, default=5000)
+    email_parser.set_defaults(func=bench_email)
+
+    mail_parser = subparsers.add_parser('mail', help="Задержка доставки кодов через локальный smtp_sink")
+    mail_parser.add_argument('--path', choices=['all', 'direct', 'queue'], default='all')
+    mail_parser.add_argument('--flows', type=int, default=100, help="одновременных подписаний")
+    mail_parser.add_argument('--latency', type=float, default=0.02, help="задержка ответа SMTP, секунд")
+    mail_parser.add_argument('--fail-rate', type=float, default=0.0)
+    mail_parser.add_argument('--domains', type=int, default=5, help="разных доменов получателей")
+    mail_parser.add_argument('--workers', type=int, default=4)
+    mail_parser.add_argument('--pool', type=int, default=4)
+    mail_parser.add_argument('--rate', type=float, default=1000, help="лимит писем в секунду")
+    mail_parser.set_defaults(func=bench_mail)
+
+    webhook_parser = subparsers.add_parser('webhook', help="Задержка обработки обновлений: polling и webhook")
+    webhook_parser.add_argument('--updates', type=int, default=200)
+    webhook_parser.add_argument('--connections', type=int, default=40, help="max_connections webhook")
+    webhook_parser.add_argument('--interval', type=float, default=0.0,
+                                help="пауза между обновлениями, секунд (0 - все сразу)")
+    webhook_parser.set_defaults(func=bench_webhook)
+
+    concurrency_parser = subparsers.add_parser('concurrency', help="Параллельная обработка обновлений")
+    concurrency_parser.add_argument('--users', type=int, default=50)
+    concurrency_parser.add_argument('--messages', type=int, default=4, help="сообщений от каждого пользователя")
+    concurrency_parser.add_argument('--work', type=float, default=0.05, help="время обработчика, секунд")
+    concurrency_parser.add_argument('--concurrency', type=int, nargs='+', default=[4, 16, 64])
+    concurrency_parser.add_argument('--burst', type=int, default=16, help="сообщений подряд от одного пользователя")
+    concurrency_parser.set_defaults(func=bench_concurrency)
+
+    startup_parser = subparsers.add_parser('startup', help="Холодный запуск: импорт, память и первый ответ")
+    startup_parser.add_argument('--bots', nargs='+', default=['lawyer_bot', 'client_bot'])
+    startup_parser.add_argument('--runs', type=int, default=5, help="запусков на вариант, берется медиана")
+    startup_parser.set_defaults(func=bench_startup)
+
+    plans_parser = subparsers.add_parser('plans', help="Проверка индексов для частых запросов")
+    plans_parser.add_argument('--db', help="Проверить существующую базу, открыв ее только для чтения "
+                                           "(по умолчанию временная база с текущей схемой)")
+    plans_parser.set_defaults(func=bench_plans)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
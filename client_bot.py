@@ -1,6 +1,5 @@
 #!/usr/bin/env python3
 import logging
-import sqlite3
 import random
 import string
 from datetime import datetime
@@ -16,67 +15,33 @@ logging.basicConfig(
         logging.StreamHandler()
     ]
 )
-DB_PATH = '/opt/bots/documents.db'
-
 # Состояния для клиента
 EMAIL_VERIFICATION = 1
 
 # Загружаем секреты
-from secrets import BOT_TOKEN_CLIENT, EMAIL_HOST, EMAIL_PORT, EMAIL_USER, EMAIL_PASSWORD, LAWYERS
-
-# Импорты для email
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from secrets import BOT_TOKEN_CLIENT, LAWYERS
 
 # Импорты для PDF штампов
-from pdf_stamp import add_signature_to_pdf
+from stamp_service import stamp_service
+
+# Хранилище документов и база данных
+import db
+from document_store import temp_path
+from mail_queue import MailQueue
+from client_cache import client_cache
+from code_store import code_store, CODE_OK, CODE_EXPIRED, CODE_MISSING, CODE_USED
+import telegram_files
+from telegram_files import TELEGRAM_PROXY, send_document
+from update_processor import PerUserUpdateProcessor
+from persistence import SQLitePersistence
+import resources
 
 def generate_code():
     """Генерирует 6-значный код"""
     return ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
 
-def send_email(to_email, code, user_name=None):
-    """Отправляет код на email клиента"""
-    try:
-        # Создаем сообщение
-        message = MIMEMultipart()
-        message['From'] = EMAIL_USER
-        message['To'] = to_email
-        
-        if user_name:
-            message['Subject'] = "Код для подписи документа"
-            body = f"""Уважаемый(ая) {user_name}!
-
-🔐 Ваш код для подписи документа: {code}
-
-⏰ Код действителен 10 минут
-
-📄 После подписи документ будет иметь юридическую силу
-
-С уважением,
-Система электронного документооборота"""
-        else:
-            message['Subject'] = "Код для подписи документа"
-            body = f"""🔐 Ваш код для подписи документа: {code}
-
-⏰ Код действителен 10 минут
-
-📄 После подписи документ будет иметь юридическую силу"""
-        
-        # Добавляем текст с правильной кодировкой
-        message.attach(MIMEText(body, 'plain', 'utf-8'))
-        
-        with smtplib.SMTP(EMAIL_HOST, EMAIL_PORT) as server:
-            server.starttls()
-            server.login(EMAIL_USER, EMAIL_PASSWORD)
-            server.send_message(message)
-        
-        logging.info(f"Код отправлен клиенту {to_email}")
-        return True
-    except Exception as e:
-        logging.error(f"Ошибка отправки email клиенту: {e}")
-        return False
+# Письма с кодами отправляются в фоне
+mail_queue = MailQueue('client')
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /start для клиента"""
@@ -94,13 +59,9 @@ async def email_verification_handler(update: Update, context: ContextTypes.DEFAU
     """Обработка ввода email клиентом"""
     email = update.message.text.strip().lower()
     
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
     try:
         # Ищем клиента по email
-        cursor.execute("SELECT id, full_name FROM clients WHERE email = ?", (email,))
-        client_data = cursor.fetchone()
+        client_data = await client_cache.find_client(email)
         
         if not client_data:
             keyboard = [
@@ -126,11 +87,7 @@ async def email_verification_handler(update: Update, context: ContextTypes.DEFAU
         context.user_data['client_email'] = email
         
         # Проверяем есть ли документы для подписи
-        cursor.execute('''
-            SELECT COUNT(*) FROM documents 
-            WHERE client_id = ? AND lawyer_signed = 1 AND client_signed = 0
-        ''', (client_id,))
-        doc_count = cursor.fetchone()[0]
+        doc_count = await client_cache.count_pending_documents(client_id)
         
         if doc_count > 0:
             keyboard = [
@@ -156,8 +113,6 @@ async def email_verification_handler(update: Update, context: ContextTypes.DEFAU
         logging.error(f"Ошибка при поиске клиента: {e}")
         await update.message.reply_text("❌ Ошибка системы. Попробуйте позже.")
         return ConversationHandler.END
-    finally:
-        conn.close()
 
 async def view_document_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показ документа клиенту"""
@@ -167,27 +122,15 @@ async def view_document_handler(update: Update, context: ContextTypes.DEFAULT_TY
     # Получаем ID клиента из callback_data
     client_id = int(query.data.replace('view_doc_', ''))
     
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
     try:
         # Получаем последний документ для клиента
-        cursor.execute('''
-            SELECT d.id, d.file_path, c.full_name, c.email, d.document_hash
-            FROM documents d 
-            JOIN clients c ON d.client_id = c.id 
-            WHERE d.client_id = ? AND d.lawyer_signed = 1 AND d.client_signed = 0
-            ORDER BY d.created_at DESC 
-            LIMIT 1
-        ''', (client_id,))
-        
-        doc_data = cursor.fetchone()
+        doc_data = await client_cache.get_latest_pending_document(client_id)
         
         if not doc_data:
             await query.edit_message_text("❌ Документ не найден или уже подписан")
             return
         
-        doc_id, file_path, client_name, client_email, document_hash = doc_data
+        doc_id, file_path, client_name, client_email, document_hash, content_hash = doc_data
         
         # Сохраняем данные для подписи
         context.user_data['current_doc_id'] = doc_id
@@ -206,14 +149,12 @@ async def view_document_handler(update: Update, context: ContextTypes.DEFAULT_TY
             f"Отправляем документ..."
         )
         
-        # Отправляем сам документ
-        with open(file_path, 'rb') as doc_file:
-            await context.bot.send_document(
-                chat_id=query.message.chat_id,
-                document=doc_file,
-                filename=f"document_{doc_id}.pdf",
-                caption="📄 Ваш документ для подписи"
-            )
+        # Отправляем сам документ (файл загружается в Telegram только при первой отправке)
+        await send_document(
+            context.bot, 'client', query.message.chat_id, doc_id, file_path, content_hash,
+            filename=f"document_{doc_id}.pdf",
+            caption="📄 Ваш документ для подписи"
+        )
         
         # Показываем кнопку подписи
         keyboard = [
@@ -232,8 +173,6 @@ async def view_document_handler(update: Update, context: ContextTypes.DEFAULT_TY
     except Exception as e:
         logging.error(f"Ошибка при показе документа: {e}")
         await query.edit_message_text("❌ Ошибка при загрузке документа")
-    finally:
-        conn.close()
 
 async def client_sign_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик подписи документа клиентом"""
@@ -243,68 +182,38 @@ async def client_sign_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
     # Получаем ID документа
     doc_id = int(query.data.replace('client_sign_', ''))
     
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
     try:
         # Получаем данные клиента
-        cursor.execute('''
-            SELECT c.email, c.full_name 
-            FROM clients c 
-            JOIN documents d ON c.id = d.client_id 
-            WHERE d.id = ?
-        ''', (doc_id,))
-        
-        client_data = cursor.fetchone()
+        client_data = await db.read_async(db.get_document_recipient, doc_id)
         
         if not client_data:
             await query.edit_message_text("❌ Данные клиента не найдены")
             return
         
-        client_email, client_name = client_data
+        client_email, client_name, _ = client_data
         
         # Генерируем код
         code = generate_code()
         
-        # Отправляем код на email клиента
-        if send_email(client_email, code, client_name):
-            # Сохраняем код в базу данных
-            expires_at = datetime.now().timestamp() + 600  # 10 минут
-            
-            cursor.execute('''
-                INSERT INTO signature_codes 
-                (document_id, user_type, code, expires_at) 
-                VALUES (?, ?, ?, datetime(?, 'unixepoch'))
-            ''', (doc_id, 'client', code, expires_at))
-            conn.commit()
-            
-            # Сохраняем данные для проверки кода
-            context.user_data['current_doc_id'] = doc_id
-            context.user_data['current_user_type'] = 'client'
-            context.user_data['client_name'] = client_name
-            
-            await query.edit_message_text(
-                f"📧 Код отправлен на {client_email}\n\n"
-                f"🔐 Введите 6-значный код здесь:\n"
-                f"(действует 10 минут)\n\n"
-                f"👤 Получатель: {client_name}"
-            )
-        else:
-            keyboard = [
-                [InlineKeyboardButton("🔄 Попробовать снова", callback_data=f"client_sign_{doc_id}")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await query.edit_message_text(
-                "❌ Ошибка отправки email. Попробуйте снова.",
-                reply_markup=reply_markup
-            )
+        # Сохраняем код и ставим письмо в очередь, не дожидаясь SMTP-сервера
+        await code_store.issue(doc_id, 'client', code)
+        await mail_queue.enqueue(query.message.chat_id, doc_id, client_email, code, client_name)
+        
+        # Сохраняем данные для проверки кода
+        context.user_data['current_doc_id'] = doc_id
+        context.user_data['current_user_type'] = 'client'
+        context.user_data['client_name'] = client_name
+        
+        await query.edit_message_text(
+            f"📧 Код отправляется на {client_email}\n\n"
+            f"🔐 Введите 6-значный код здесь:\n"
+            f"(действует 10 минут)\n\n"
+            f"👤 Получатель: {client_name}"
+        )
             
     except Exception as e:
         logging.error(f"Ошибка при подготовке подписи клиента: {e}")
         await query.edit_message_text("❌ Ошибка системы. Попробуйте снова.")
-    finally:
-        conn.close()
 
 async def verify_client_code_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Проверка введенного кода клиентом"""
@@ -318,50 +227,24 @@ async def verify_client_code_handler(update: Update, context: ContextTypes.DEFAU
     user_type = context.user_data['current_user_type']
     client_name = context.user_data.get('client_name', 'клиент')
     
-    # Проверяем код в базе данных
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
     try:
-        cursor.execute('''
-            SELECT code, expires_at, attempts 
-            FROM signature_codes 
-            WHERE document_id = ? AND user_type = ?
-            ORDER BY created_at DESC 
-            LIMIT 1
-        ''', (doc_id, user_type))
+        # Проверяем код: действующие коды хранятся в памяти, верный код погашается в базе
+        result, attempts = await code_store.verify(doc_id, user_type, entered_code)
         
-        code_data = cursor.fetchone()
-        
-        if not code_data:
+        if result in (CODE_MISSING, CODE_USED):
             await update.message.reply_text("❌ Код не найден. Начните процесс подписи заново.")
             context.user_data.clear()
             return
         
-        expected_code, expires_at, attempts = code_data
-        
-        # Проверяем время действия
-        if datetime.now() > datetime.strptime(expires_at, '%Y-%m-%d %H:%M:%S'):
+        if result == CODE_EXPIRED:
             await update.message.reply_text("⏰ Время действия кода истекло. Начните заново.")
             context.user_data.clear()
             return
         
-        # Проверяем код
-        if entered_code == expected_code:
-            # Код верный - подписываем документ клиентом
-            cursor.execute(
-                "UPDATE documents SET client_signed = 1 WHERE id = ?",
-                (doc_id,)
-            )
-            
-            # Получаем данные для штампа
-            cursor.execute('''
-                SELECT d.file_path, d.document_hash 
-                FROM documents d 
-                WHERE d.id = ?
-            ''', (doc_id,))
-            
-            stamp_data = cursor.fetchone()
+        if result == CODE_OK:
+            # Код верный - накладываем штамп; подпись отмечается вместе с новой версией файла
+            stamp_data = await db.read_async(db.get_client_stamp_data, doc_id)
+            signed = False
             
             if stamp_data:
                 file_path, document_hash = stamp_data
@@ -370,10 +253,6 @@ async def verify_client_code_handler(update: Update, context: ContextTypes.DEFAU
                 lawyer_name = list(LAWYERS.values())[0]['full_name'] if LAWYERS else "Адвокат"
                 lawyer_sign_date = datetime.now().strftime("%d.%m.%Y %H:%M:%S")
                 
-                lawyer_data = cursor.fetchone()
-                lawyer_name = lawyer_data[0] if lawyer_data else "Адвокат"
-                lawyer_sign_date = lawyer_data[1] if lawyer_data else datetime.now().strftime("%d.%m.%Y %H:%M:%S")
-                
                 # Создаем данные для штампа
                 signature_data = {
                     'document_hash': document_hash,
@@ -387,26 +266,33 @@ async def verify_client_code_handler(update: Update, context: ContextTypes.DEFAU
                 
                 # Добавляем штамп в PDF
                 try:
-                    final_file_path = file_path.replace('.pdf', '_final.pdf')
-                    if add_signature_to_pdf(file_path, signature_data, final_file_path):
-                        # Обновляем путь к файлу в базе
-                        cursor.execute(
-                            "UPDATE documents SET file_path = ? WHERE id = ?",
-                            (final_file_path, doc_id)
-                        )
+                    # Незавершенный временный файл удалит сборщик мусора хранилища
+                    final_temp_path = temp_path()
+                    content_hash = await stamp_service.add_signature_to_pdf(file_path, signature_data, final_temp_path)
+                    if content_hash:
+                        # Сохраняем файл со штампом и отмечаем подпись клиента
+                        await db.write_async(db.mark_client_signed, doc_id, final_temp_path, content_hash)
+                        signed = True
                         logging.info(f"Штамп клиента добавлен в документ {doc_id}")
                     else:
                         logging.error(f"Ошибка при добавлении штампа клиента в документ {doc_id}")
                         
                 except Exception as e:
                     logging.error(f"Ошибка при добавлении штампа: {e}")
-                    # Продолжаем работу даже если штамп не добавился
             
-            conn.commit()
+            if not signed:
+                # Документ остается неподписанным, подпись можно повторить
+                keyboard = [[InlineKeyboardButton("🔄 Подписать снова", callback_data=f"client_sign_{doc_id}")]]
+                await update.message.reply_text(
+                    "⚠️ Не удалось добавить штамп электронной подписи в документ.\n"
+                    "Документ не подписан. Попробуйте подписать его снова.",
+                    reply_markup=InlineKeyboardMarkup(keyboard)
+                )
+                context.user_data.clear()
+                return
             
             # Получаем путь к файлу для отправки
-            cursor.execute("SELECT file_path FROM documents WHERE id = ?", (doc_id,))
-            file_path = cursor.fetchone()[0]
+            file_path, content_hash = await db.read_async(db.get_document_file, doc_id)
             
             await update.message.reply_text(
                 f"✅ Документ успешно подписан!\n\n"
@@ -415,12 +301,11 @@ async def verify_client_code_handler(update: Update, context: ContextTypes.DEFAU
             )
             
             # Отправляем подписанный документ
-            with open(file_path, 'rb') as doc_file:
-                await update.message.reply_document(
-                    document=doc_file,
-                    filename=f"подписанный_документ_{doc_id}.pdf",
-                    caption="📄 Документ подписан вами и адвокатом"
-                )
+            await send_document(
+                context.bot, 'client', update.message.chat_id, doc_id, file_path, content_hash,
+                filename=f"подписанный_документ_{doc_id}.pdf",
+                caption="📄 Документ подписан вами и адвокатом"
+            )
             
             await update.message.reply_text(
                 "🎉 Процесс подписания завершен!\n"
@@ -431,18 +316,12 @@ async def verify_client_code_handler(update: Update, context: ContextTypes.DEFAU
             context.user_data.clear()
             
         else:
-            # Неверный код - увеличиваем счетчик попыток
-            cursor.execute(
-                "UPDATE signature_codes SET attempts = attempts + 1 WHERE document_id = ? AND user_type = ?",
-                (doc_id, user_type)
-            )
-            conn.commit()
-            
-            remaining_attempts = 3 - (attempts + 1)
+            # Неверный код - счетчик попыток уже увеличен в хранилище кодов
+            remaining_attempts = 3 - attempts
             
             if remaining_attempts > 0:
                 await update.message.reply_text(
-                    f"❌ Неверный код. Попыток: {attempts + 1}/3\n"
+                    f"❌ Неверный код. Попыток: {attempts}/3\n"
                     f"Осталось попыток: {remaining_attempts}\n"
                     f"Введите код еще раз:"
                 )
@@ -462,11 +341,43 @@ async def verify_client_code_handler(update: Update, context: ContextTypes.DEFAU
     except Exception as e:
         logging.error(f"Ошибка при проверке кода клиента: {e}")
         await update.message.reply_text("❌ Ошибка системы. Попробуйте снова.")
-    finally:
-        conn.close()
 
-def main():
-    application = Application.builder().token(BOT_TOKEN_CLIENT).build()
+async def on_startup(application):
+    """Запускает отправку писем из очереди и прогрев модулей"""
+    async def notify_mail_failure(chat_id, document_id, to_email):
+        keyboard = [[InlineKeyboardButton("🔄 Попробовать снова", callback_data=f"client_sign_{document_id}")]]
+        await application.bot.send_message(
+            chat_id=chat_id,
+            text=f"❌ Не удалось отправить код на {to_email}",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+    
+    await mail_queue.start(notify_mail_failure)
+    # Модули PDF и почты загружаются в фоне, пока бот уже отвечает
+    resources.schedule_warm_up()
+
+async def on_shutdown(application):
+    """Останавливает очередь писем бота; общие пулы закрывает resources.close()"""
+    await resources.stop_warm_up()
+    await code_store.flush()
+    await mail_queue.stop()
+    await telegram_files.close()
+
+def build_application():
+    """Создает приложение бота со всеми обработчиками"""
+    # Обновления разных пользователей обрабатываются параллельно, одного - по очереди;
+    # user_data и состояния диалогов переживают перезапуск
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN_CLIENT)
+        .proxy(TELEGRAM_PROXY)
+        .get_updates_proxy(TELEGRAM_PROXY)
+        .concurrent_updates(PerUserUpdateProcessor())
+        .persistence(SQLitePersistence('client'))
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
     
     # Обработчик разговора для проверки email
     conv_handler = ConversationHandler(
@@ -474,7 +385,9 @@ def main():
         states={
             EMAIL_VERIFICATION: [MessageHandler(filters.TEXT & ~filters.COMMAND, email_verification_handler)],
         },
-        fallbacks=[]
+        fallbacks=[],
+        name='email_verification',
+        persistent=True
     )
     
     # Обработчики кнопок
@@ -488,8 +401,19 @@ def main():
         verify_client_code_handler
     ))
     
+    return application
+
+def main():
+    # Инициализируем базу данных при запуске
+    db.init_database()
+    
+    application = build_application()
+    
     print("Бот клиента запущен...")
-    application.run_polling()
+    try:
+        application.run_polling()
+    finally:
+        resources.close()
 
 if __name__ == "__main__":
     main()
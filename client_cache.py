@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+import time
+from collections import OrderedDict
+
+import secrets as _secrets
+
+import db
+
+# Необязательные настройки из secrets.py
+CLIENT_CACHE_SIZE = getattr(_secrets, 'CLIENT_CACHE_SIZE', 1024)   # записей
+CLIENT_CACHE_TTL = getattr(_secrets, 'CLIENT_CACHE_TTL', 300)      # секунд
+
+class ClientCache:
+    """Кеш клиентов по email и документов, ожидающих подписи клиента
+
+    Записи вытесняются по LRU и живут не дольше ttl секунд. Перед каждым
+    обращением проверяется PRAGMA data_version: пока ни одно соединение
+    (в том числе бот адвоката в другом процессе) ничего не записало, база
+    не читается. Если запись была, из журнала change_log, который ведут
+    триггеры на clients и documents, читаются только новые строки и
+    сбрасываются записи затронутых клиентов.
+    """
+
+    def __init__(self, size=CLIENT_CACHE_SIZE, ttl=CLIENT_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()   # ключ -> (значение, время истечения)
+        self._data_version = None
+        self._last_change = None
+        self.hits = 0
+        self.misses = 0
+
+    async def _sync(self):
+        """Сбрасывает записи клиентов, изменившихся с прошлой проверки"""
+        data_version = await db.data_version_async()
+        if data_version == self._data_version:
+            return
+
+        if self._last_change is None:
+            self._last_change = await db.read_async(db.last_change_id)
+        else:
+            after = self._last_change
+            changes = await db.read_async(db.get_changes, after)
+            if changes and changes[0][0] != after + 1:
+                # Часть журнала уже удалена обслуживанием: неизвестно, что изменилось
+                self._entries.clear()
+            for change_id, client_id, email in changes:
+                self._entries.pop(('client', email), None)
+                self._entries.pop(('pending', client_id), None)
+                self._entries.pop(('latest', client_id), None)
+                self._last_change = max(self._last_change, change_id)
+        # Версию запоминаем только после сброса: до этого другие обработчики тоже сверяются с журналом
+        self._data_version = data_version
+
+    async def _get(self, key, query, *args):
+        await self._sync()
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] > now:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        last_change = self._last_change
+        value = await db.read_async(query, *args)
+        # Пока шел запрос, журнал мог сбросить этот ключ: такой результат не кешируем
+        if self._last_change == last_change:
+            self._entries[key] = (value, now + self.ttl)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return value
+
+    async def find_client(self, email):
+        """(id, full_name) клиента или None"""
+        return await self._get(('client', email), db.find_client_by_email, email)
+
+    async def count_pending_documents(self, client_id):
+        """Количество документов, ожидающих подписи клиента"""
+        return await self._get(('pending', client_id), db.count_pending_documents, client_id)
+
+    async def get_latest_pending_document(self, client_id):
+        """Последний документ для подписи, как db.get_latest_pending_document"""
+        return await self._get(('latest', client_id), db.get_latest_pending_document, client_id)
+
+client_cache = ClientCache()
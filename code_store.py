@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+import asyncio
+import heapq
+import logging
+import time
+
+import secrets as _secrets
+
+import db
+
+# Необязательные настройки из secrets.py
+CODE_TTL = getattr(_secrets, 'CODE_TTL', 600)                      # срок действия кода, секунд
+CODE_FLUSH_DELAY = getattr(_secrets, 'CODE_FLUSH_DELAY', 5)        # задержка записи счетчиков попыток
+
+# Результаты проверки кода
+CODE_OK = 'ok'
+CODE_WRONG = 'wrong'
+CODE_EXPIRED = 'expired'
+CODE_MISSING = 'missing'
+CODE_USED = 'used'
+
+class CodeStore:
+    """Действующие коды подписи в памяти с истечением по времени
+
+    Код документа ищется в словаре по (document_id, user_type) без запроса
+    к базе; истекшие коды удаляются по куче сроков действия. SQLite остается
+    журналом и источником истины между процессами:
+    - новый код записывается в signature_codes сразу;
+    - счетчики неверных попыток записываются пачкой через CODE_FLUSH_DELAY;
+    - код погашается условным UPDATE, который пройдет только один раз,
+      даже если тот же код проверяют несколько процессов;
+    - если кода нет в памяти (перезапуск, код выдан другим процессом),
+      он читается из базы.
+    """
+
+    def __init__(self, ttl=CODE_TTL, flush_delay=CODE_FLUSH_DELAY):
+        self.ttl = ttl
+        self.flush_delay = flush_delay
+        self._codes = {}     # (document_id, user_type) -> [id, code, expires_at, attempts]
+        self._expiry = []    # куча (expires_at, id, ключ)
+        self._attempts = {}  # id -> число попыток, еще не записанное в базу
+        self._flush_task = None
+
+    def _expire(self, now):
+        """Удаляет коды, срок действия которых прошел"""
+        while self._expiry and self._expiry[0][0] <= now:
+            _, code_id, key = heapq.heappop(self._expiry)
+            entry = self._codes.get(key)
+            if entry is not None and entry[0] == code_id:
+                del self._codes[key]
+
+    def _put(self, key, code_id, code, expires_at, attempts):
+        entry = self._codes[key] = [code_id, code, expires_at, attempts]
+        heapq.heappush(self._expiry, (expires_at, code_id, key))
+        return entry
+
+    def _forget(self, key):
+        entry = self._codes.pop(key, None)
+        if entry is not None:
+            self._attempts.pop(entry[0], None)
+
+    async def issue(self, document_id, user_type, code):
+        """Сохраняет новый код документа; предыдущий код перестает действовать"""
+        expires_at = time.time() + self.ttl
+        code_id = await db.write_async(db.save_signature_code, document_id, user_type, code, expires_at)
+        self._forget((document_id, user_type))
+        self._put((document_id, user_type), code_id, code, expires_at, 0)
+
+    async def _load(self, key):
+        """Последний код документа из базы или None, если он уже использован"""
+        row = await db.read_async(db.get_latest_code, *key)
+        if row is None or row[4] is not None:
+            return None
+        code_id, code, expires_at, attempts, _ = row
+        entry = self._codes.get(key)
+        if entry is not None and entry[0] == code_id:
+            return entry
+        if expires_at > time.time():
+            return self._put(key, code_id, code, expires_at, attempts)
+        # Истекший код не кешируется, но нужен, чтобы сообщить об истечении
+        return [code_id, code, expires_at, attempts]
+
+    async def verify(self, document_id, user_type, entered_code):
+        """Проверяет введенный код и при совпадении погашает его
+
+        Возвращает (результат, число неверных попыток).
+        """
+        key = (document_id, user_type)
+        now = time.time()
+        self._expire(now)
+
+        entry = self._codes.get(key)
+        if entry is None or entered_code != entry[1]:
+            # Промах в памяти или неверный код: новый код мог выдать другой процесс
+            fresh = await self._load(key)
+            if fresh is None:
+                self._forget(key)
+                return CODE_MISSING, 0
+            entry = fresh
+
+        code_id, expected_code, expires_at, attempts = entry
+        if now > expires_at:
+            return CODE_EXPIRED, attempts
+
+        if entered_code != expected_code:
+            entry[3] = attempts + 1
+            self._attempts[code_id] = entry[3]
+            self._schedule_flush()
+            return CODE_WRONG, entry[3]
+
+        consumed = await db.write_async(db.consume_signature_code, code_id, document_id, user_type, attempts)
+        self._forget(key)
+        return (CODE_OK if consumed else CODE_USED), attempts
+
+    def _schedule_flush(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        try:
+            await asyncio.sleep(self.flush_delay)
+        finally:
+            self._flush_task = None
+        await self._write_attempts()
+
+    async def _write_attempts(self):
+        """Записывает накопленные счетчики попыток одной транзакцией"""
+        attempts, self._attempts = self._attempts, {}
+        if not attempts:
+            return
+        try:
+            await db.write_async(db.save_code_attempts, [(count, code_id) for code_id, count in attempts.items()])
+        except Exception as e:
+            logging.error(f"Ошибка записи счетчиков попыток ввода кода: {e}")
+
+    async def flush(self):
+        """Записывает счетчики попыток немедленно; вызывается при остановке бота"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        await self._write_attempts()
+
+code_store = CodeStore()
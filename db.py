@@ -0,0 +1,864 @@
+#!/usr/bin/env python3
+
+import asyncio
+import logging
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import secrets as _secrets
+from document_store import SCHEMA as DOCUMENT_STORE_SCHEMA, reuse_file, store_file
+
+DB_PATH = '/opt/bots/documents.db'
+
+# Настройки каждого соединения
+PRAGMAS = (
+    "PRAGMA auto_vacuum = INCREMENTAL", # для новой базы; старую переводит compact_database
+    "PRAGMA journal_mode = WAL",       # читатели не блокируются писателем
+    "PRAGMA synchronous = NORMAL",     # в режиме WAL безопасно и без fsync на каждый коммит
+    "PRAGMA cache_size = -16000",      # 16 МБ кеша страниц
+    "PRAGMA mmap_size = 268435456",    # 256 МБ отображения файла в память
+    "PRAGMA busy_timeout = 5000",      # ждать блокировку другого процесса до 5 с
+    "PRAGMA foreign_keys = ON",
+)
+
+# Размер кеша подготовленных выражений на соединение
+CACHED_STATEMENTS = 256
+
+# Количество потоков для параллельных чтений (необязательная настройка из secrets.py)
+DB_READERS = getattr(_secrets, 'DB_READERS', 4)
+
+_local = threading.local()
+
+def get_connection():
+    """Возвращает долгоживущее соединение текущего потока
+
+    sqlite3 кеширует подготовленные выражения на соединении, поэтому
+    повторные запросы с тем же текстом SQL не компилируются заново.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, cached_statements=CACHED_STATEMENTS)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        _local.conn = conn
+    return conn
+
+def close_connection():
+    """Закрывает соединение текущего потока"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+@contextmanager
+def transaction():
+    """Транзакция на соединении текущего потока
+
+    Внутри транзакции нельзя использовать await: соединение общее для всех
+    обработчиков, которые выполняются в этом потоке.
+    """
+    conn = get_connection()
+    try:
+        yield conn.cursor()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+def read(query, *args):
+    """Выполняет функцию чтения query(cursor, *args)"""
+    return query(get_connection().cursor(), *args)
+
+def write(query, *args):
+    """Выполняет функцию записи query(cursor, *args) в отдельной транзакции"""
+    with transaction() as cursor:
+        return query(cursor, *args)
+
+# Асинхронный доступ для обработчиков: запросы выполняются вне event loop.
+# Чтения идут параллельно в пуле потоков, у каждого потока свое соединение.
+# Записи выстраиваются в очередь к единственному потоку-писателю, поэтому
+# внутри процесса они не конкурируют за блокировку базы.
+_read_executor = None
+_write_executor = None
+_version_executor = None
+
+def _executors():
+    """Создает пулы потоков при первом использовании"""
+    global _read_executor, _write_executor
+    if _write_executor is None:
+        _read_executor = ThreadPoolExecutor(DB_READERS, thread_name_prefix='db-read')
+        _write_executor = ThreadPoolExecutor(1, thread_name_prefix='db-write')
+    return _read_executor, _write_executor
+
+async def read_async(query, *args):
+    """Асинхронно выполняет функцию чтения query(cursor, *args)"""
+    read_executor, _ = _executors()
+    return await asyncio.get_running_loop().run_in_executor(read_executor, read, query, *args)
+
+async def write_async(query, *args):
+    """Асинхронно выполняет функцию записи query(cursor, *args) в потоке-писателе"""
+    _, write_executor = _executors()
+    return await asyncio.get_running_loop().run_in_executor(write_executor, write, query, *args)
+
+def _with_connection(func, *args):
+    return func(get_connection(), *args)
+
+async def connection_async(func, *args):
+    """Асинхронно выполняет func(conn, *args) в потоке-писателе вне транзакции
+
+    Для долгих операций, которые сами фиксируют изменения по частям.
+    """
+    _, write_executor = _executors()
+    return await asyncio.get_running_loop().run_in_executor(write_executor, _with_connection, func, *args)
+
+async def data_version_async():
+    """Асинхронно читает PRAGMA data_version в отдельном потоке
+
+    У каждого соединения свой счетчик, поэтому все проверки идут через
+    одно соединение одного потока, а не через пул читателей.
+    """
+    global _version_executor
+    if _version_executor is None:
+        _version_executor = ThreadPoolExecutor(1, thread_name_prefix='db-version')
+    return await asyncio.get_running_loop().run_in_executor(_version_executor, data_version)
+
+def _close_reader_connections(read_executor):
+    """Закрывает соединения всех потоков-читателей
+
+    Закрыть соединение можно только в его потоке. Задачи ждут друг друга
+    на барьере, поэтому каждая из DB_READERS задач выполняется в своем потоке.
+    """
+    barrier = threading.Barrier(DB_READERS)
+
+    def close():
+        close_connection()
+        try:
+            barrier.wait(timeout=5)
+        except threading.BrokenBarrierError:
+            pass
+
+    for _ in range(DB_READERS):
+        read_executor.submit(close)
+
+def shutdown():
+    """Останавливает пулы потоков базы данных и закрывает их соединения"""
+    global _read_executor, _write_executor, _version_executor
+    if _version_executor is not None:
+        _version_executor.submit(close_connection)
+        _version_executor.shutdown(wait=True)
+        _version_executor = None
+    if _write_executor is not None:
+        _write_executor.submit(close_connection)
+        _write_executor.shutdown(wait=True)
+        _close_reader_connections(_read_executor)
+        _read_executor.shutdown(wait=True)
+        _read_executor = _write_executor = None
+
+def _add_content_hash_column(cursor):
+    """SHA-256 содержимого текущей версии файла
+
+    В базах, созданных до появления миграций, колонка уже может быть.
+    """
+    cursor.execute("PRAGMA table_info(documents)")
+    if 'content_hash' not in [column[1] for column in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE documents ADD COLUMN content_hash TEXT")
+
+# Миграции схемы: (версия, описание, шаги). Шаг - SQL-выражение или функция
+# от курсора. Примененные версии записываются в schema_version, новые
+# миграции добавляются только в конец списка. Первые миграции повторяют
+# прежний init_database и безопасны для уже существующих баз.
+MIGRATIONS = [
+    (1, "Таблицы клиентов, документов и кодов подписи", [
+        '''
+        CREATE TABLE IF NOT EXISTS clients (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email TEXT UNIQUE NOT NULL,
+            full_name TEXT NOT NULL,
+            client_code TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS documents (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            client_id INTEGER,
+            file_path TEXT NOT NULL,
+            lawyer_signed BOOLEAN DEFAULT 0,
+            client_signed BOOLEAN DEFAULT 0,
+            document_hash TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (client_id) REFERENCES clients (id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS signature_codes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            document_id INTEGER,
+            user_type TEXT,
+            code TEXT,
+            attempts INTEGER DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            expires_at DATETIME,
+            FOREIGN KEY (document_id) REFERENCES documents (id)
+        )
+        ''',
+    ]),
+    (2, "Хранилище документов по SHA-256", [_add_content_hash_column] + DOCUMENT_STORE_SCHEMA),
+    (3, "Индексы для частых запросов", [
+        # Последний код документа: WHERE document_id AND user_type ORDER BY created_at
+        '''
+        CREATE INDEX IF NOT EXISTS idx_signature_codes_document
+        ON signature_codes (document_id, user_type, created_at)
+        ''',
+        # Документы, ожидающие подписи клиента; частичный индекс хранит только их
+        '''
+        CREATE INDEX IF NOT EXISTS idx_documents_pending
+        ON documents (client_id, created_at)
+        WHERE lawyer_signed = 1 AND client_signed = 0
+        ''',
+        # Все документы клиента и соединения по client_id
+        '''
+        CREATE INDEX IF NOT EXISTS idx_documents_client
+        ON documents (client_id)
+        ''',
+    ]),
+    (4, "Очередь исходящих писем", [
+        '''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            bot TEXT NOT NULL,
+            chat_id INTEGER,
+            document_id INTEGER,
+            to_email TEXT NOT NULL,
+            code TEXT NOT NULL,
+            name TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            sent_at DATETIME
+        )
+        ''',
+        # Выборка следующего письма: WHERE bot AND status ORDER BY next_attempt_at
+        '''
+        CREATE INDEX IF NOT EXISTS idx_outbox_due
+        ON outbox (bot, status, next_attempt_at)
+        ''',
+    ]),
+    (5, "file_id загруженных в Telegram версий документов", [
+        # file_id действителен только для бота, который загрузил файл
+        '''
+        CREATE TABLE IF NOT EXISTS telegram_files (
+            bot TEXT NOT NULL,
+            document_id INTEGER NOT NULL,
+            content_hash TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (bot, document_id, content_hash)
+        )
+        ''',
+    ]),
+    (6, "Файлы, загруженные адвокатами", [
+        # file_unique_id одинаков для одного и того же файла у всех ботов
+        '''
+        CREATE TABLE IF NOT EXISTS telegram_uploads (
+            file_unique_id TEXT PRIMARY KEY,
+            file_id TEXT NOT NULL,
+            content_hash TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+    (7, "Сохраненные user_data и состояния диалогов ботов", [
+        # kind: 'user', 'chat', 'bot' или 'conversation:<имя ConversationHandler>'
+        '''
+        CREATE TABLE IF NOT EXISTS persistence (
+            bot TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            data TEXT NOT NULL,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (bot, kind, key)
+        )
+        ''',
+    ]),
+    (8, "Время использования кода подписи", [
+        "ALTER TABLE signature_codes ADD COLUMN consumed_at DATETIME",
+    ]),
+    (9, "Индексы для очистки старых кодов и писем", [
+        '''
+        CREATE INDEX IF NOT EXISTS idx_signature_codes_expires
+        ON signature_codes (expires_at)
+        ''',
+        # Отправленные и окончательно не отправленные письма
+        '''
+        CREATE INDEX IF NOT EXISTS idx_outbox_finished
+        ON outbox (created_at)
+        WHERE status IN ('sent', 'failed')
+        ''',
+    ]),
+    (10, "Журнал изменений клиентов и документов для сброса кешей", [
+        # Каждая строка - клиент (и email), данные которого изменились
+        '''
+        CREATE TABLE IF NOT EXISTS change_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            client_id INTEGER,
+            email TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_change_log_created
+        ON change_log (created_at)
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS change_log_clients_insert AFTER INSERT ON clients
+        BEGIN
+            INSERT INTO change_log (client_id, email) VALUES (NEW.id, NEW.email);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS change_log_clients_update AFTER UPDATE ON clients
+        BEGIN
+            INSERT INTO change_log (client_id, email) VALUES (NEW.id, NEW.email);
+            INSERT INTO change_log (client_id, email) SELECT OLD.id, OLD.email WHERE OLD.email IS NOT NEW.email;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS change_log_clients_delete AFTER DELETE ON clients
+        BEGIN
+            INSERT INTO change_log (client_id, email) VALUES (OLD.id, OLD.email);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS change_log_documents_insert AFTER INSERT ON documents
+        BEGIN
+            INSERT INTO change_log (client_id) VALUES (NEW.client_id);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS change_log_documents_update AFTER UPDATE ON documents
+        BEGIN
+            INSERT INTO change_log (client_id) VALUES (NEW.client_id);
+            INSERT INTO change_log (client_id) SELECT OLD.client_id WHERE OLD.client_id IS NOT NEW.client_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS change_log_documents_delete AFTER DELETE ON documents
+        BEGIN
+            INSERT INTO change_log (client_id) VALUES (OLD.client_id);
+        END
+        ''',
+    ]),
+]
+
+def schema_version(cursor):
+    """Номер последней примененной миграции (0 для пустой базы)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return cursor.fetchone()[0]
+
+def migrate(conn):
+    """Применяет недостающие миграции, каждую в своей транзакции
+
+    BEGIN IMMEDIATE сразу берет блокировку записи, поэтому два бота,
+    запущенные одновременно, не применят одну миграцию дважды.
+    Возвращает номер версии схемы после миграций.
+    """
+    cursor = conn.cursor()
+    version = schema_version(cursor)
+    conn.commit()
+
+    for number, description, steps in MIGRATIONS:
+        if number <= version:
+            continue
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            if schema_version(cursor) >= number:
+                conn.rollback()
+                continue
+            for step in steps:
+                if callable(step):
+                    step(cursor)
+                else:
+                    cursor.execute(step)
+            cursor.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                (number, description)
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logging.info(f"Миграция схемы {number}: {description}")
+        version = number
+
+    return version
+
+def init_database():
+    """Инициализирует базу данных и применяет миграции схемы"""
+    version = migrate(get_connection())
+    logging.info(f"База данных инициализирована, версия схемы {version}")
+
+# Клиенты
+
+def find_client_by_email(cursor, email):
+    """Возвращает (id, full_name) клиента или None"""
+    cursor.execute("SELECT id, full_name FROM clients WHERE email = ?", (email,))
+    return cursor.fetchone()
+
+def upsert_client(cursor, email, full_name):
+    """Создает клиента или обновляет ФИО существующего
+
+    Возвращает (client_id, created).
+    """
+    cursor.execute("SELECT id FROM clients WHERE email = ?", (email,))
+    existing_client = cursor.fetchone()
+
+    if existing_client:
+        client_id = existing_client[0]
+        cursor.execute("UPDATE clients SET full_name = ? WHERE id = ?", (full_name, client_id))
+        return client_id, False
+
+    cursor.execute("INSERT INTO clients (email, full_name) VALUES (?, ?)", (email, full_name))
+    return cursor.lastrowid, True
+
+# Документы
+
+def add_document(cursor, client_id, temp_file_path, content_hash, document_hash):
+    """Переносит загруженный файл в хранилище и создает документ
+
+    Возвращает (document_id, file_path).
+    """
+    file_path = store_file(cursor, temp_file_path, content_hash)
+    cursor.execute(
+        "INSERT INTO documents (client_id, file_path, document_hash, content_hash) VALUES (?, ?, ?, ?)",
+        (client_id, file_path, document_hash, content_hash)
+    )
+    return cursor.lastrowid, file_path
+
+def add_document_from_blob(cursor, client_id, content_hash, document_hash):
+    """Создает документ для файла, который уже есть в хранилище
+
+    Возвращает (document_id, file_path) или None, если файла в хранилище нет.
+    """
+    file_path = reuse_file(cursor, content_hash)
+    if file_path is None:
+        return None
+    cursor.execute(
+        "INSERT INTO documents (client_id, file_path, document_hash, content_hash) VALUES (?, ?, ?, ?)",
+        (client_id, file_path, document_hash, content_hash)
+    )
+    return cursor.lastrowid, file_path
+
+def get_document_recipient(cursor, document_id):
+    """Возвращает (email, full_name, file_path) клиента документа или None"""
+    cursor.execute('''
+        SELECT c.email, c.full_name, d.file_path
+        FROM clients c
+        JOIN documents d ON c.id = d.client_id
+        WHERE d.id = ?
+    ''', (document_id,))
+    return cursor.fetchone()
+
+def get_document_file(cursor, document_id):
+    """Возвращает (file_path, content_hash) текущей версии файла документа или None"""
+    cursor.execute("SELECT file_path, content_hash FROM documents WHERE id = ?", (document_id,))
+    return cursor.fetchone()
+
+def count_pending_documents(cursor, client_id):
+    """Количество документов, подписанных адвокатом и ожидающих подписи клиента"""
+    cursor.execute('''
+        SELECT COUNT(*) FROM documents
+        WHERE client_id = ? AND lawyer_signed = 1 AND client_signed = 0
+    ''', (client_id,))
+    return cursor.fetchone()[0]
+
+def get_latest_pending_document(cursor, client_id):
+    """Возвращает (id, file_path, full_name, email, document_hash, content_hash) последнего документа для подписи"""
+    cursor.execute('''
+        SELECT d.id, d.file_path, c.full_name, c.email, d.document_hash, d.content_hash
+        FROM documents d
+        JOIN clients c ON d.client_id = c.id
+        WHERE d.client_id = ? AND d.lawyer_signed = 1 AND d.client_signed = 0
+        ORDER BY d.created_at DESC
+        LIMIT 1
+    ''', (client_id,))
+    return cursor.fetchone()
+
+def get_lawyer_stamp_data(cursor, document_id):
+    """Возвращает (file_path, document_hash, client_name) для штампа адвоката или None"""
+    cursor.execute('''
+        SELECT d.file_path, d.document_hash, c.full_name
+        FROM documents d
+        JOIN clients c ON d.client_id = c.id
+        WHERE d.id = ?
+    ''', (document_id,))
+    return cursor.fetchone()
+
+def get_client_stamp_data(cursor, document_id):
+    """Возвращает (file_path, document_hash) для штампа клиента или None"""
+    cursor.execute("SELECT file_path, document_hash FROM documents WHERE id = ?", (document_id,))
+    return cursor.fetchone()
+
+def mark_lawyer_signed(cursor, document_id, temp_file_path, content_hash):
+    """Сохраняет версию файла со штампом адвоката и отмечает его подпись"""
+    update_document_file(cursor, document_id, temp_file_path, content_hash)
+    cursor.execute("UPDATE documents SET lawyer_signed = 1 WHERE id = ?", (document_id,))
+
+def mark_client_signed(cursor, document_id, temp_file_path, content_hash):
+    """Сохраняет версию файла со штампом клиента и отмечает его подпись"""
+    update_document_file(cursor, document_id, temp_file_path, content_hash)
+    cursor.execute("UPDATE documents SET client_signed = 1 WHERE id = ?", (document_id,))
+
+def update_document_file(cursor, document_id, temp_file_path, content_hash):
+    """Переносит новую версию файла в хранилище и привязывает ее к документу
+
+    Возвращает путь к файлу в хранилище.
+    """
+    file_path = store_file(cursor, temp_file_path, content_hash)
+    cursor.execute(
+        "UPDATE documents SET file_path = ?, content_hash = ? WHERE id = ?",
+        (file_path, content_hash, document_id)
+    )
+    # file_id прежних версий больше не понадобятся
+    cursor.execute("DELETE FROM telegram_files WHERE document_id = ?", (document_id,))
+    return file_path
+
+# Коды подписи
+
+def save_signature_code(cursor, document_id, user_type, code, expires_at):
+    """Сохраняет код подписи и возвращает его id; expires_at - unix-время окончания действия"""
+    cursor.execute('''
+        INSERT INTO signature_codes
+        (document_id, user_type, code, expires_at)
+        VALUES (?, ?, ?, datetime(?, 'unixepoch'))
+    ''', (document_id, user_type, code, expires_at))
+    return cursor.lastrowid
+
+def get_latest_code(cursor, document_id, user_type):
+    """Возвращает (id, code, expires_at, attempts, consumed_at) последнего кода или None
+
+    expires_at - unix-время окончания действия.
+    """
+    cursor.execute('''
+        SELECT id, code, CAST(strftime('%s', expires_at) AS INTEGER), attempts, consumed_at
+        FROM signature_codes
+        WHERE document_id = ? AND user_type = ?
+        ORDER BY created_at DESC, id DESC
+        LIMIT 1
+    ''', (document_id, user_type))
+    return cursor.fetchone()
+
+def save_code_attempts(cursor, attempts):
+    """Записывает счетчики неверных попыток [(attempts, id)]; счетчик не уменьшается"""
+    cursor.executemany(
+        "UPDATE signature_codes SET attempts = MAX(attempts, ?) WHERE id = ?",
+        attempts
+    )
+
+def consume_signature_code(cursor, code_id, document_id, user_type, attempts):
+    """Погашает код, если он последний для документа, не истек и еще не использован
+
+    Условный UPDATE выполняется атомарно, поэтому код можно использовать
+    только один раз, даже если его проверяют несколько процессов.
+    Возвращает True, если код погашен этим вызовом.
+    """
+    cursor.execute('''
+        UPDATE signature_codes
+        SET consumed_at = CURRENT_TIMESTAMP, attempts = MAX(attempts, ?)
+        WHERE id = ? AND consumed_at IS NULL AND expires_at > CURRENT_TIMESTAMP
+          AND NOT EXISTS (
+              SELECT 1 FROM signature_codes AS newer
+              WHERE newer.document_id = ? AND newer.user_type = ? AND newer.id > ?
+          )
+    ''', (attempts, code_id, document_id, user_type, code_id))
+    return cursor.rowcount == 1
+
+def purge_expired_codes(cursor, retention_seconds, limit):
+    """Удаляет до limit кодов, истекших больше retention_seconds назад; возвращает число строк"""
+    cursor.execute('''
+        DELETE FROM signature_codes WHERE id IN (
+            SELECT id FROM signature_codes
+            WHERE expires_at < datetime('now', ?)
+            LIMIT ?
+        )
+    ''', (f"-{int(retention_seconds)} seconds", limit))
+    return cursor.rowcount
+
+# Очередь исходящих писем
+
+def enqueue_mail(cursor, bot, chat_id, document_id, to_email, code, name):
+    """Ставит письмо с кодом в очередь и возвращает его id"""
+    cursor.execute('''
+        INSERT INTO outbox (bot, chat_id, document_id, to_email, code, name, next_attempt_at)
+        VALUES (?, ?, ?, ?, ?, ?, strftime('%s', 'now'))
+    ''', (bot, chat_id, document_id, to_email, code, name))
+    return cursor.lastrowid
+
+def claim_mail(cursor, bot, now, domain=None, limit=1):
+    """Забирает письма, время отправки которых наступило
+
+    Если задан domain, только письма на адреса этого домена.
+    Возвращает список (id, chat_id, document_id, to_email, code, name, attempts).
+    """
+    query = '''
+        SELECT id, chat_id, document_id, to_email, code, name, attempts
+        FROM outbox
+        WHERE bot = ? AND status = 'pending' AND next_attempt_at <= ?
+    '''
+    params = [bot, now]
+    if domain is not None:
+        query += " AND to_email LIKE ?"
+        params.append(f"%@{domain}")
+    query += " ORDER BY next_attempt_at LIMIT ?"
+    params.append(limit)
+    cursor.execute(query, params)
+
+    claimed = []
+    for mail in cursor.fetchall():
+        cursor.execute("UPDATE outbox SET status = 'sending' WHERE id = ? AND status = 'pending'", (mail[0],))
+        if cursor.rowcount:
+            claimed.append(mail)
+    return claimed
+
+def count_queued_mail(cursor, bot):
+    """Количество писем бота, ожидающих отправки"""
+    cursor.execute("SELECT COUNT(*) FROM outbox WHERE bot = ? AND status IN ('pending', 'sending')", (bot,))
+    return cursor.fetchone()[0]
+
+def mark_mail_sent(cursor, mail_id):
+    """Отмечает письмо отправленным"""
+    cursor.execute(
+        "UPDATE outbox SET status = 'sent', attempts = attempts + 1, sent_at = CURRENT_TIMESTAMP WHERE id = ?",
+        (mail_id,)
+    )
+
+def schedule_mail_retry(cursor, mail_id, next_attempt_at, error):
+    """Возвращает письмо в очередь для повторной попытки"""
+    cursor.execute('''
+        UPDATE outbox
+        SET status = 'pending', attempts = attempts + 1, next_attempt_at = ?, last_error = ?
+        WHERE id = ?
+    ''', (next_attempt_at, error, mail_id))
+
+def mark_mail_failed(cursor, mail_id, error):
+    """Отмечает письмо неотправленным после исчерпания попыток"""
+    cursor.execute(
+        "UPDATE outbox SET status = 'failed', attempts = attempts + 1, last_error = ? WHERE id = ?",
+        (error, mail_id)
+    )
+
+def release_mail(cursor, mail_ids):
+    """Возвращает в очередь забранные письма, результат отправки которых не записан"""
+    cursor.executemany("UPDATE outbox SET status = 'pending' WHERE id = ? AND status = 'sending'",
+                       [(mail_id,) for mail_id in mail_ids])
+
+def reset_stuck_mail(cursor, bot):
+    """Возвращает в очередь письма, отправка которых прервалась при остановке бота"""
+    cursor.execute("UPDATE outbox SET status = 'pending' WHERE bot = ? AND status = 'sending'", (bot,))
+    return cursor.rowcount
+
+def purge_finished_mail(cursor, retention_seconds, limit):
+    """Удаляет до limit отправленных или неотправленных писем старше retention_seconds"""
+    cursor.execute('''
+        DELETE FROM outbox WHERE id IN (
+            SELECT id FROM outbox
+            WHERE status IN ('sent', 'failed') AND created_at < datetime('now', ?)
+            LIMIT ?
+        )
+    ''', (f"-{int(retention_seconds)} seconds", limit))
+    return cursor.rowcount
+
+# file_id документов в Telegram
+
+def get_telegram_file_id(cursor, bot, document_id, content_hash):
+    """Возвращает file_id версии документа, уже загруженной ботом, или None"""
+    cursor.execute(
+        "SELECT file_id FROM telegram_files WHERE bot = ? AND document_id = ? AND content_hash = ?",
+        (bot, document_id, content_hash)
+    )
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def save_telegram_file_id(cursor, bot, document_id, content_hash, file_id):
+    """Запоминает file_id загруженной версии документа"""
+    cursor.execute('''
+        INSERT OR REPLACE INTO telegram_files (bot, document_id, content_hash, file_id)
+        VALUES (?, ?, ?, ?)
+    ''', (bot, document_id, content_hash, file_id))
+
+def delete_telegram_file_id(cursor, bot, document_id, content_hash):
+    """Забывает file_id, который Telegram перестал принимать"""
+    cursor.execute(
+        "DELETE FROM telegram_files WHERE bot = ? AND document_id = ? AND content_hash = ?",
+        (bot, document_id, content_hash)
+    )
+
+# Файлы, загруженные в бота
+
+def get_upload_content_hash(cursor, file_unique_id):
+    """SHA-256 ранее загруженного файла с таким file_unique_id или None"""
+    cursor.execute("SELECT content_hash FROM telegram_uploads WHERE file_unique_id = ?", (file_unique_id,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def save_upload(cursor, file_unique_id, file_id, content_hash):
+    """Запоминает загруженный файл, чтобы не скачивать его повторно"""
+    cursor.execute('''
+        INSERT OR REPLACE INTO telegram_uploads (file_unique_id, file_id, content_hash)
+        VALUES (?, ?, ?)
+    ''', (file_unique_id, file_id, content_hash))
+
+# Сохраненное состояние ботов (persistence.py)
+
+def load_persistence(cursor, bot, kind):
+    """Пары (ключ, данные в JSON) одного вида для бота"""
+    cursor.execute("SELECT key, data FROM persistence WHERE bot = ? AND kind = ?", (bot, kind))
+    return cursor.fetchall()
+
+def save_persistence(cursor, bot, items):
+    """Записывает изменения [(вид, ключ, JSON или None для удаления)] одной транзакцией"""
+    cursor.executemany('''
+        INSERT OR REPLACE INTO persistence (bot, kind, key, data, updated_at)
+        VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+    ''', [(bot, kind, key, data) for kind, key, data in items if data is not None])
+    cursor.executemany(
+        "DELETE FROM persistence WHERE bot = ? AND kind = ? AND key = ?",
+        [(bot, kind, key) for kind, key, data in items if data is None]
+    )
+
+# Журнал изменений для сброса кешей (client_cache.py)
+
+def data_version():
+    """PRAGMA data_version соединения текущего потока
+
+    Значение меняется после коммита любого другого соединения, в том числе
+    из другого процесса. Прагма не читает страницы базы.
+    """
+    return get_connection().execute("PRAGMA data_version").fetchone()[0]
+
+def last_change_id(cursor):
+    """id последней записи журнала изменений (0, если журнал пуст)"""
+    cursor.execute("SELECT MAX(id) FROM change_log")
+    return cursor.fetchone()[0] or 0
+
+def get_changes(cursor, after_id):
+    """Записи журнала [(id, client_id, email)] после after_id"""
+    cursor.execute("SELECT id, client_id, email FROM change_log WHERE id > ? ORDER BY id", (after_id,))
+    return cursor.fetchall()
+
+def purge_change_log(cursor, retention_seconds, limit):
+    """Удаляет до limit записей журнала изменений старше retention_seconds"""
+    cursor.execute('''
+        DELETE FROM change_log WHERE id IN (
+            SELECT id FROM change_log
+            WHERE created_at < datetime('now', ?)
+            LIMIT ?
+        )
+    ''', (f"-{int(retention_seconds)} seconds", limit))
+    return cursor.rowcount
+
+# Обслуживание файла базы
+
+def compact_database(cursor):
+    """Возвращает свободные страницы файлу и обновляет статистику планировщика
+
+    Базы, созданные без auto_vacuum, один раз переводятся в режим
+    INCREMENTAL полным VACUUM; дальше достаточно incremental_vacuum.
+    Возвращает число байт, на которое уменьшился файл.
+    """
+    cursor.execute("PRAGMA page_size")
+    page_size = cursor.fetchone()[0]
+    cursor.execute("PRAGMA page_count")
+    pages_before = cursor.fetchone()[0]
+
+    cursor.execute("PRAGMA auto_vacuum")
+    if cursor.fetchone()[0] != 2:
+        logging.info("База: включение auto_vacuum = INCREMENTAL, полный VACUUM")
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        cursor.execute("VACUUM")
+    else:
+        # execute() делает только один шаг прагмы и освобождает одну страницу
+        cursor.executescript("PRAGMA incremental_vacuum")
+    cursor.execute("PRAGMA page_count")
+    pages_after = cursor.fetchone()[0]
+
+    # optimize может добавить страницы sqlite_stat1; это не результат сжатия
+    cursor.execute("PRAGMA optimize")
+    return max(pages_before - pages_after, 0) * page_size
+
+# Проверка планов запросов
+
+# Частые запросы и примерные аргументы для EXPLAIN QUERY PLAN
+HOT_QUERIES = [
+    (find_client_by_email, ('client@example.com',)),
+    (get_document_recipient, (1,)),
+    (get_document_file, (1,)),
+    (count_pending_documents, (1,)),
+    (get_latest_pending_document, (1,)),
+    (get_lawyer_stamp_data, (1,)),
+    (get_client_stamp_data, (1,)),
+    (get_latest_code, (1, 'client')),
+    (save_code_attempts, ([(1, 1)],)),
+    (consume_signature_code, (1, 1, 'client', 0)),
+    (claim_mail, ('client', 0)),
+    (get_telegram_file_id, ('client', 1, 'hash')),
+    (get_upload_content_hash, ('unique',)),
+    (load_persistence, ('client', 'user')),
+    (purge_expired_codes, (86400, 500)),
+    (purge_finished_mail, (86400, 500)),
+    (get_changes, (0,)),
+    (last_change_id, ()),
+    (purge_change_log, (86400, 500)),
+]
+
+class _PlanCursor:
+    """Курсор, который вместо выполнения запросов собирает их планы"""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.plan = []
+        self.rowcount = 0
+        self._rows = []
+
+    def execute(self, sql, params=()):
+        self.cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+        self._rows = self.cursor.fetchall()
+        self.rowcount = len(self._rows)
+        self.plan.extend(row[3] for row in self._rows)
+
+    def executemany(self, sql, seq_of_params):
+        for params in seq_of_params[:1]:
+            self.execute(sql, params)
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def fetchall(self):
+        return self._rows
+
+def is_full_scan(detail):
+    """Шаг плана читает всю таблицу или сортирует результат во временном B-дереве"""
+    return detail.startswith('SCAN') or 'TEMP B-TREE' in detail
+
+def explain_hot_queries(cursor):
+    """Возвращает {имя запроса: [шаги плана]} для частых запросов
+
+    Запросы не выполняются, база не изменяется.
+    """
+    plans = {}
+    for query, args in HOT_QUERIES:
+        plan_cursor = _PlanCursor(cursor)
+        query(plan_cursor, *args)
+        plans[query.__name__] = plan_cursor.plan
+    return plans
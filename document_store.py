@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+import hashlib
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime
+
+# Хранилище файлов, адресуемых по SHA-256 содержимого:
+# /opt/bots/documents/blobs/ab/cd/abcd....pdf
+DOCUMENTS_DIR = '/opt/bots/documents'
+BLOBS_DIR = os.path.join(DOCUMENTS_DIR, 'blobs')
+TMP_DIR = os.path.join(BLOBS_DIR, 'tmp')
+
+# Сколько хранить файл без ссылок, прежде чем удалить его
+ORPHAN_GRACE_SECONDS = 24 * 60 * 60
+
+def generate_document_hash(client_id, document_name):
+    """Генерирует уникальный хеш документа"""
+    unique_string = f"{client_id}_{document_name}_{datetime.now().timestamp()}"
+    return hashlib.md5(unique_string.encode()).hexdigest()
+
+class HashingWriter:
+    """Файловый объект-обертка, считающий SHA-256 всех записанных данных"""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.sha256.update(data)
+        return self.fileobj.write(data)
+
+    def tell(self):
+        return self.fileobj.tell()
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+# Таблица файлов хранилища. ref_count поддерживается триггерами на documents
+SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS blobs (
+        content_hash TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        ref_count INTEGER NOT NULL DEFAULT 0,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS blobs_ref_insert AFTER INSERT ON documents
+    WHEN NEW.content_hash IS NOT NULL
+    BEGIN
+        UPDATE blobs SET ref_count = ref_count + 1, updated_at = CURRENT_TIMESTAMP
+        WHERE content_hash = NEW.content_hash;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS blobs_ref_update AFTER UPDATE OF content_hash ON documents
+    WHEN OLD.content_hash IS NOT NEW.content_hash
+    BEGIN
+        UPDATE blobs SET ref_count = ref_count - 1, updated_at = CURRENT_TIMESTAMP
+        WHERE content_hash = OLD.content_hash;
+        UPDATE blobs SET ref_count = ref_count + 1, updated_at = CURRENT_TIMESTAMP
+        WHERE content_hash = NEW.content_hash;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS blobs_ref_delete AFTER DELETE ON documents
+    WHEN OLD.content_hash IS NOT NULL
+    BEGIN
+        UPDATE blobs SET ref_count = ref_count - 1, updated_at = CURRENT_TIMESTAMP
+        WHERE content_hash = OLD.content_hash;
+    END
+    ''',
+]
+
+def blob_path(content_hash):
+    """Путь к файлу по его SHA-256 (двухуровневое шардирование по префиксу хеша)"""
+    return os.path.join(BLOBS_DIR, content_hash[:2], content_hash[2:4], f"{content_hash}.pdf")
+
+def temp_path():
+    """Создает временный файл внутри хранилища для записи новой версии"""
+    os.makedirs(TMP_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(suffix='.pdf', dir=TMP_DIR)
+    os.close(fd)
+    return path
+
+def store_file(cursor, temp_file_path, content_hash):
+    """Перемещает временный файл в хранилище и регистрирует его в таблице blobs
+
+    Если файл с таким содержимым уже есть, временный файл удаляется и
+    используется существующий. Возвращает путь к файлу в хранилище.
+    """
+    path = blob_path(content_hash)
+
+    # Сначала обновляем updated_at: запись блокирует базу до коммита,
+    # поэтому сборщик мусора не удалит файл, пока на него не появится ссылка
+    cursor.execute('''
+        INSERT INTO blobs (content_hash, size) VALUES (?, ?)
+        ON CONFLICT(content_hash) DO UPDATE SET updated_at = CURRENT_TIMESTAMP
+    ''', (content_hash, os.path.getsize(temp_file_path)))
+
+    if os.path.exists(path):
+        os.remove(temp_file_path)
+        logging.info(f"Файл {content_hash[:16]} уже есть в хранилище, копия не создается")
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_file_path, path)
+    return path
+
+def reuse_file(cursor, content_hash):
+    """Возвращает путь к уже сохраненному файлу с таким SHA-256 или None
+
+    Как и store_file, обновляет updated_at, чтобы сборщик мусора не удалил
+    файл до появления на него ссылки.
+    """
+    cursor.execute(
+        "UPDATE blobs SET updated_at = CURRENT_TIMESTAMP WHERE content_hash = ?",
+        (content_hash,)
+    )
+    path = blob_path(content_hash)
+    if cursor.rowcount and os.path.exists(path):
+        return path
+    return None
+
+def collect_garbage(conn, grace_seconds=ORPHAN_GRACE_SECONDS):
+    """Удаляет файлы хранилища, на которые больше не ссылается ни один документ
+
+    Каждое удаление фиксируется сразу, поэтому conn не должно быть внутри
+    транзакции: из event loop вызывайте через db.connection_async.
+    Возвращает количество удаленных файлов и освобожденный объем в байтах.
+    """
+    cursor = conn.cursor()
+    grace = f"-{int(grace_seconds)} seconds"
+    cursor.execute('''
+        SELECT content_hash, size FROM blobs
+        WHERE ref_count <= 0 AND updated_at < datetime('now', ?)
+    ''', (grace,))
+    orphans = cursor.fetchall()
+
+    removed, freed = 0, 0
+    for content_hash, size in orphans:
+        # Повторяем условия: за это время на файл могла появиться ссылка
+        cursor.execute('''
+            DELETE FROM blobs
+            WHERE content_hash = ? AND ref_count <= 0 AND updated_at < datetime('now', ?)
+        ''', (content_hash, grace))
+        if cursor.rowcount:
+            try:
+                os.remove(blob_path(content_hash))
+            except FileNotFoundError:
+                pass
+            removed += 1
+            freed += size
+        conn.commit()
+
+    # Недописанные временные файлы после аварийного завершения
+    if os.path.isdir(TMP_DIR):
+        for name in os.listdir(TMP_DIR):
+            path = os.path.join(TMP_DIR, name)
+            try:
+                if time.time() - os.path.getmtime(path) > grace_seconds:
+                    size = os.path.getsize(path)
+                    os.remove(path)
+                    freed += size
+            except FileNotFoundError:
+                # Файл успел переименовать или удалить другой процесс
+                pass
+
+    if removed:
+        logging.info(f"Хранилище: удалено файлов без ссылок {removed}, освобождено {freed} байт")
+    return removed, freed
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+import base64
+import functools
+from email.generator import BytesGenerator
+from email.header import Header
+from email.mime.multipart import MIMEMultipart
+from email.mime.nonmultipart import MIMENonMultipart
+from email.policy import compat32
+from io import BytesIO
+
+from secrets import EMAIL_USER
+
+SENDER = EMAIL_USER
+
+SUBJECT = "Код для подписи документа"
+
+# Тексты писем с кодами; {code} и {name} подставляются при отправке
+TEMPLATES = {
+    'lawyer_code': """Код для подписи документа клиентом {name}:
+
+🔐 Ваш код: {code}
+
+⏰ Код действителен 10 минут
+
+📄 Документ будет подписан после ввода кода""",
+
+    'lawyer_code_anonymous': """🔐 Ваш код для подписи документа: {code}
+
+⏰ Код действителен 10 минут
+
+📄 Документ будет подписан после ввода кода""",
+
+    'client_code': """Уважаемый(ая) {name}!
+
+🔐 Ваш код для подписи документа: {code}
+
+⏰ Код действителен 10 минут
+
+📄 После подписи документ будет иметь юридическую силу
+
+С уважением,
+Система электронного документооборота""",
+
+    'client_code_anonymous': """🔐 Ваш код для подписи документа: {code}
+
+⏰ Код действителен 10 минут
+
+📄 После подписи документ будет иметь юридическую силу""",
+}
+
+# Метки, на месте которых в заготовке письма оказываются получатель и текст
+_TO_MARK = '@@TO@@'
+_BODY_MARK = '@@BODY@@'
+
+@functools.lru_cache(maxsize=None)
+def _skeleton(template_name):
+    """Заготовка письма: закодированные заголовки и MIME-обвязка без получателя и текста
+
+    Собирается один раз на шаблон. Возвращает (head, middle, tail):
+    письмо = head + получатель + middle + текст в base64 + tail.
+    """
+    message = MIMEMultipart(boundary=f"=============={template_name}==")
+    message['From'] = SENDER
+    message['To'] = _TO_MARK
+    message['Subject'] = SUBJECT
+
+    # Та же структура, что у MIMEText(body, 'plain', 'utf-8')
+    text = MIMENonMultipart('text', 'plain', charset='utf-8')
+    text['Content-Transfer-Encoding'] = 'base64'
+    text.set_payload(_BODY_MARK)
+    message.attach(text)
+
+    out = BytesIO()
+    BytesGenerator(out, policy=compat32.clone(linesep='\r\n')).flatten(message)
+    head, rest = out.getvalue().split(_TO_MARK.encode(), 1)
+    middle, tail = rest.split(_BODY_MARK.encode(), 1)
+    return head, middle, tail
+
+def _encode_recipient(to_email):
+    """Адрес получателя для заголовка To"""
+    try:
+        return to_email.encode('ascii')
+    except UnicodeEncodeError:
+        return Header(to_email, 'utf-8').encode().encode('ascii')
+
+def render(template_name, to_email, code, name=None):
+    """Возвращает письмо в виде байтов, готовых для SMTP DATA"""
+    head, middle, tail = _skeleton(template_name)
+    body = TEMPLATES[template_name].format(code=code, name=name)
+    encoded_body = base64.encodebytes(body.encode('utf-8')).replace(b'\n', b'\r\n')
+    return head + _encode_recipient(to_email) + middle + encoded_body + tail
+
+def build_code_email(bot, to_email, code, name=None):
+    """Письмо с кодом подписи для бота 'lawyer' или 'client'"""
+    template_name = f"{bot}_code" if name else f"{bot}_code_anonymous"
+    return render(template_name, to_email, code, name)
@@ -2,8 +2,6 @@
 import logging
 import sqlite3
 import re
-import os
-import smtplib
 import random
 import string
 from datetime import datetime
@@ -19,117 +17,37 @@ logging.basicConfig(
         logging.StreamHandler()
     ]
 )
-DB_PATH = '/opt/bots/documents.db'
-
 # Состояния для добавления клиента
 EMAIL, FULL_NAME, DOCUMENT = range(3)
 
 # Загружаем секреты
-from secrets import BOT_TOKEN_LAWYER, LAWYERS, EMAIL_HOST, EMAIL_PORT, EMAIL_USER, EMAIL_PASSWORD
-
-# Импорты для email
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from secrets import BOT_TOKEN_LAWYER, LAWYERS
 
 # Импорты для PDF штампов
-from pdf_stamp import add_signature_to_pdf, generate_document_hash, update_document_hash_in_db
+from stamp_service import stamp_service
+
+# Хранилище документов и база данных
+import db
+from document_store import collect_garbage, generate_document_hash, temp_path
+from mail_queue import MailQueue
+from code_store import code_store, CODE_OK, CODE_EXPIRED, CODE_MISSING, CODE_USED
+import telegram_files
+from telegram_files import TELEGRAM_PROXY
+from update_processor import PerUserUpdateProcessor
+from persistence import SQLitePersistence
+import resources
+import maintenance
 
 def check_lawyer_access(user_id):
     """Проверяет доступ адвоката"""
     return user_id in LAWYERS
 
-def init_database():
-    """Инициализирует базу данных если нужно"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    # Включаем проверку внешних ключей
-    conn.execute("PRAGMA foreign_keys = ON")
-    
-    # Создаем таблицу clients если не существует
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS clients (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            email TEXT UNIQUE NOT NULL,
-            full_name TEXT NOT NULL,
-            client_code TEXT,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Создаем таблицу documents если не существует
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS documents (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            client_id INTEGER,
-            file_path TEXT NOT NULL,
-            lawyer_signed BOOLEAN DEFAULT 0,
-            client_signed BOOLEAN DEFAULT 0,
-            document_hash TEXT,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (client_id) REFERENCES clients (id)
-        )
-    ''')
-    
-    # Создаем таблицу для кодов подписи
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS signature_codes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            document_id INTEGER,
-            user_type TEXT,
-            code TEXT,
-            attempts INTEGER DEFAULT 0,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            expires_at DATETIME,
-            FOREIGN KEY (document_id) REFERENCES documents (id)
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
-    logging.info("База данных инициализирована")
-
 def generate_code():
     """Генерирует 6-значный код"""
     return ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
 
-def send_email(to_email, code, client_name=None):
-    """Отправляет код на email"""
-    try:
-        # Создаем сообщение
-        message = MIMEMultipart()
-        message['From'] = EMAIL_USER
-        message['To'] = to_email
-        
-        if client_name:
-            message['Subject'] = "Код для подписи документа"
-            body = f"""Код для подписи документа клиентом {client_name}:
-
-🔐 Ваш код: {code}
-
-⏰ Код действителен 10 минут
-
-📄 Документ будет подписан после ввода кода"""
-        else:
-            message['Subject'] = "Код для подписи документа"
-            body = f"""🔐 Ваш код для подписи документа: {code}
-
-⏰ Код действителен 10 минут
-
-📄 Документ будет подписан после ввода кода"""
-        
-        # Добавляем текст с правильной кодировкой
-        message.attach(MIMEText(body, 'plain', 'utf-8'))
-        
-        with smtplib.SMTP(EMAIL_HOST, EMAIL_PORT) as server:
-            server.starttls()
-            server.login(EMAIL_USER, EMAIL_PASSWORD)
-            server.send_message(message)
-        
-        logging.info(f"Код отправлен на {to_email}")
-        return True
-    except Exception as e:
-        logging.error(f"Ошибка отправки email: {e}")
-        return False
+# Письма с кодами отправляются в фоне
+mail_queue = MailQueue('lawyer')
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /start"""
@@ -213,54 +131,42 @@ async def document_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Файл слишком большой (макс 20MB). Загрузите другой файл:")
         return DOCUMENT
     
-    # Сохраняем информацию о клиенте в базу
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
     try:
-        # Сначала проверяем нет ли уже такого email
-        cursor.execute("SELECT id FROM clients WHERE email = ?", (context.user_data['email'],))
-        existing_client = cursor.fetchone()
-        
-        if existing_client:
-            client_id = existing_client[0]
-            # Обновляем ФИО если клиент уже существует
-            cursor.execute("UPDATE clients SET full_name = ? WHERE id = ?", 
-                         (context.user_data['full_name'], client_id))
-            logging.info(f"Обновлен существующий клиент: {client_id}")
-        else:
-            # Создаем нового клиента
-            cursor.execute(
-                "INSERT INTO clients (email, full_name) VALUES (?, ?)",
-                (context.user_data['email'], context.user_data['full_name'])
-            )
-            client_id = cursor.lastrowid
+        # Сохраняем информацию о клиенте в базу
+        client_id, created = await db.write_async(
+            db.upsert_client, context.user_data['email'], context.user_data['full_name']
+        )
+        if created:
             logging.info(f"Создан новый клиент: {client_id}")
-        
-        conn.commit()
-        
-        # Создаем папку для документов если не существует
-        os.makedirs('/opt/bots/documents', exist_ok=True)
-        
-        # Сохраняем информацию о документе
-        file = await document.get_file()
-        file_name = f"{client_id}_{document.file_name}"
-        file_path = f"/opt/bots/documents/{file_name}"
-        
-        await file.download_to_drive(file_path)
-        logging.info(f"Документ сохранен: {file_path}")
+        else:
+            logging.info(f"Обновлен существующий клиент: {client_id}")
         
         # Генерируем хеш документа
         document_hash = generate_document_hash(client_id, document.file_name)
         
-        # Сохраняем документ в базу
-        cursor.execute(
-            "INSERT INTO documents (client_id, file_path, document_hash) VALUES (?, ?, ?)",
-            (client_id, file_path, document_hash)
-        )
-        document_id = cursor.lastrowid
-        conn.commit()
+        # Тот же файл уже загружали (file_unique_id не меняется) - берем его из хранилища
+        saved = None
+        content_hash = await db.read_async(db.get_upload_content_hash, document.file_unique_id)
+        if content_hash:
+            saved = await db.write_async(db.add_document_from_blob, client_id, content_hash, document_hash)
+            if saved:
+                logging.info(f"Файл {document.file_unique_id} уже загружался, скачивание пропущено")
+        
+        if saved is None:
+            file = await document.get_file()
+            
+            # Файл скачивается частями, SHA-256 считается во время записи
+            temp_file_path = temp_path()
+            content_hash = await telegram_files.download_to_path(file, temp_file_path)
+            
+            # Сохраняем документ в базу; одинаковые файлы хранятся в одном экземпляре
+            saved = await db.write_async(
+                db.add_document, client_id, temp_file_path, content_hash, document_hash
+            )
+            await db.write_async(db.save_upload, document.file_unique_id, document.file_id, content_hash)
         
+        document_id, file_path = saved
+        logging.info(f"Документ {document.file_name} сохранен: {file_path}")
         logging.info(f"Документ добавлен в базу для клиента {client_id}")
         
         # Показываем кнопку подписи
@@ -284,8 +190,6 @@ async def document_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logging.error(f"Общая ошибка: {e}")
         await update.message.reply_text("❌ Произошла ошибка. Попробуйте снова.")
         return ConversationHandler.END
-    finally:
-        conn.close()
     
     # Очищаем временные данные
     context.user_data.clear()
@@ -305,18 +209,9 @@ async def sign_document_handler(update: Update, context: ContextTypes.DEFAULT_TY
     # Получаем ID документа из callback_data (sign_123 → 123)
     document_id = int(query.data.replace('sign_', ''))
     
-    # Получаем информацию о клиенте из базы
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
     try:
-        cursor.execute('''
-            SELECT c.email, c.full_name, d.file_path 
-            FROM clients c 
-            JOIN documents d ON c.id = d.client_id 
-            WHERE d.id = ?
-        ''', (document_id,))
-        document_data = cursor.fetchone()
+        # Получаем информацию о клиенте из базы
+        document_data = await db.read_async(db.get_document_recipient, document_id)
         
         if not document_data:
             await query.edit_message_text("❌ Документ не найден")
@@ -328,35 +223,23 @@ async def sign_document_handler(update: Update, context: ContextTypes.DEFAULT_TY
         code = generate_code()
         lawyer_info = LAWYERS[user_id]
         
-        # Отправляем код на email адвоката
-        if send_email(lawyer_info['email'], code, client_name):
-            # Сохраняем код в базу данных
-            expires_at = datetime.now().timestamp() + 600  # 10 минут
-            
-            cursor.execute('''
-                INSERT INTO signature_codes 
-                (document_id, user_type, code, expires_at) 
-                VALUES (?, ?, ?, datetime(?, 'unixepoch'))
-            ''', (document_id, 'lawyer', code, expires_at))
-            conn.commit()
-            
-            # Сохраняем ID документа для проверки кода
-            context.user_data['current_document_id'] = document_id
-            context.user_data['current_user_type'] = 'lawyer'
-            
-            await query.edit_message_text(
-                f"📧 Код отправлен на {lawyer_info['email']}\n\n"
-                f"🔐 Введите 6-значный код здесь:\n"
-                f"(действует 10 минут)"
-            )
-        else:
-            await query.edit_message_text("❌ Ошибка отправки email. Попробуйте снова.")
+        # Сохраняем код и ставим письмо в очередь, не дожидаясь SMTP-сервера
+        await code_store.issue(document_id, 'lawyer', code)
+        await mail_queue.enqueue(query.message.chat_id, document_id, lawyer_info['email'], code, client_name)
+        
+        # Сохраняем ID документа для проверки кода
+        context.user_data['current_document_id'] = document_id
+        context.user_data['current_user_type'] = 'lawyer'
+        
+        await query.edit_message_text(
+            f"📧 Код отправляется на {lawyer_info['email']}\n\n"
+            f"🔐 Введите 6-значный код здесь:\n"
+            f"(действует 10 минут)"
+        )
             
     except Exception as e:
         logging.error(f"Ошибка при подготовке подписи: {e}")
         await query.edit_message_text("❌ Ошибка системы. Попробуйте снова.")
-    finally:
-        conn.close()
 
 async def verify_code_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Проверка введенного кода"""
@@ -375,53 +258,27 @@ async def verify_code_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
     document_id = context.user_data['current_document_id']
     user_type = context.user_data['current_user_type']
     
-    # Проверяем код в базе данных
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
     try:
-        cursor.execute('''
-            SELECT code, expires_at, attempts 
-            FROM signature_codes 
-            WHERE document_id = ? AND user_type = ?
-            ORDER BY created_at DESC 
-            LIMIT 1
-        ''', (document_id, user_type))
+        # Проверяем код: действующие коды хранятся в памяти, верный код погашается в базе
+        result, attempts = await code_store.verify(document_id, user_type, entered_code)
         
-        code_data = cursor.fetchone()
-        
-        if not code_data:
+        if result in (CODE_MISSING, CODE_USED):
             await update.message.reply_text("❌ Код не найден. Начните процесс подписи заново.")
             context.user_data.clear()
             return
         
-        expected_code, expires_at, attempts = code_data
-        
-        # Проверяем время действия
-        if datetime.now() > datetime.strptime(expires_at, '%Y-%m-%d %H:%M:%S'):
+        if result == CODE_EXPIRED:
             await update.message.reply_text("⏰ Время действия кода истекло. Начните заново.")
             context.user_data.clear()
             return
         
-        # Проверяем код
-        if entered_code == expected_code:
-            # Код верный - подписываем документ
-            cursor.execute(
-                "UPDATE documents SET lawyer_signed = 1 WHERE id = ?",
-                (document_id,)
-            )
-            
-            # Получаем данные для штампа
-            cursor.execute('''
-                SELECT d.file_path, d.document_hash, c.full_name 
-                FROM documents d 
-                JOIN clients c ON d.client_id = c.id 
-                WHERE d.id = ?
-            ''', (document_id,))
-            
-            stamp_data = cursor.fetchone()
+        if result == CODE_OK:
+            # Код верный - накладываем штамп; подпись отмечается вместе с новой версией файла
+            stamp_data = await db.read_async(db.get_lawyer_stamp_data, document_id)
             
             lawyer_info = LAWYERS[user_id]
+            client_name = "клиента"
+            signed = False
             
             if stamp_data:
                 file_path, document_hash, client_name = stamp_data
@@ -438,32 +295,30 @@ async def verify_code_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
                 
                 # Добавляем штамп в PDF
                 try:
-                    signed_file_path = file_path.replace('.pdf', '_signed.pdf')
-                    if add_signature_to_pdf(file_path, signature_data, signed_file_path):
-                        # Обновляем путь к файлу в базе
-                        cursor.execute(
-                            "UPDATE documents SET file_path = ? WHERE id = ?",
-                            (signed_file_path, document_id)
-                        )
+                    # Незавершенный временный файл удалит сборщик мусора хранилища
+                    signed_temp_path = temp_path()
+                    content_hash = await stamp_service.add_signature_to_pdf(file_path, signature_data, signed_temp_path)
+                    if content_hash:
+                        # Сохраняем файл со штампом и отмечаем подпись адвоката
+                        await db.write_async(db.mark_lawyer_signed, document_id, signed_temp_path, content_hash)
+                        signed = True
                         logging.info(f"Штамп адвоката добавлен в документ {document_id}")
                     else:
                         logging.error(f"Ошибка при добавлении штампа адвоката в документ {document_id}")
                         
                 except Exception as e:
                     logging.error(f"Ошибка при добавлении штампа: {e}")
-                    # Продолжаем работу даже если штамп не добавился
-            
-            conn.commit()
             
-            # Получаем информацию о клиенте для сообщения
-            cursor.execute('''
-                SELECT c.full_name 
-                FROM clients c 
-                JOIN documents d ON c.id = d.client_id 
-                WHERE d.id = ?
-            ''', (document_id,))
-            client_data = cursor.fetchone()
-            client_name = client_data[0] if client_data else "клиента"
+            if not signed:
+                # Документ остается неподписанным, подпись можно повторить
+                keyboard = [[InlineKeyboardButton("🔄 Подписать снова", callback_data=f"sign_{document_id}")]]
+                await update.message.reply_text(
+                    "⚠️ Не удалось добавить штамп электронной подписи в документ.\n"
+                    "Документ не подписан. Попробуйте подписать его снова.",
+                    reply_markup=InlineKeyboardMarkup(keyboard)
+                )
+                context.user_data.clear()
+                return
             
             await update.message.reply_text(
                 f"✅ Документ успешно подписан!\n\n"
@@ -476,29 +331,52 @@ async def verify_code_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
             context.user_data.clear()
             
         else:
-            # Неверный код - увеличиваем счетчик попыток
-            cursor.execute(
-                "UPDATE signature_codes SET attempts = attempts + 1 WHERE document_id = ? AND user_type = ?",
-                (document_id, user_type)
-            )
-            conn.commit()
-            
+            # Неверный код - счетчик попыток уже увеличен в хранилище кодов
             await update.message.reply_text(
-                f"❌ Неверный код. Попыток: {attempts + 1}/3\n"
+                f"❌ Неверный код. Попыток: {attempts}/3\n"
                 f"Введите код еще раз:"
             )
             
     except Exception as e:
         logging.error(f"Ошибка при проверке кода: {e}")
         await update.message.reply_text("❌ Ошибка системы. Попробуйте снова.")
-    finally:
-        conn.close()
 
-def main():
-    # Инициализируем базу данных при запуске
-    init_database()
+async def on_startup(application):
+    """Запускает отправку писем из очереди и прогрев модулей"""
+    async def notify_mail_failure(chat_id, document_id, to_email):
+        keyboard = [[InlineKeyboardButton("🔄 Отправить код снова", callback_data=f"sign_{document_id}")]]
+        await application.bot.send_message(
+            chat_id=chat_id,
+            text=f"❌ Не удалось отправить код на {to_email}",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
     
-    application = Application.builder().token(BOT_TOKEN_LAWYER).build()
+    await mail_queue.start(notify_mail_failure)
+    # Модули PDF и почты загружаются в фоне, пока бот уже отвечает
+    resources.schedule_warm_up()
+
+async def on_shutdown(application):
+    """Останавливает очередь писем бота; общие пулы закрывает resources.close()"""
+    await resources.stop_warm_up()
+    await code_store.flush()
+    await mail_queue.stop()
+    await telegram_files.close()
+
+def build_application():
+    """Создает приложение бота со всеми обработчиками"""
+    # Обновления разных пользователей обрабатываются параллельно, одного - по очереди;
+    # user_data и состояния диалогов переживают перезапуск
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN_LAWYER)
+        .proxy(TELEGRAM_PROXY)
+        .get_updates_proxy(TELEGRAM_PROXY)
+        .concurrent_updates(PerUserUpdateProcessor())
+        .persistence(SQLitePersistence('lawyer'))
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
     
     # Обработчик разговора для добавления клиента
     conv_handler = ConversationHandler(
@@ -509,7 +387,9 @@ def main():
             DOCUMENT: [MessageHandler(filters.Document.PDF, document_handler)],
         },
         fallbacks=[CommandHandler('start', start)],
-        allow_reentry=True
+        allow_reentry=True,
+        name='add_client',
+        persistent=True
     )
     
     # Обработчик ввода кода подписи
@@ -523,8 +403,25 @@ def main():
     application.add_handler(CallbackQueryHandler(sign_document_handler, pattern='^sign_'))
     application.add_handler(code_handler)
     
+    # Очистка старых кодов, писем и файлов, сжатие базы
+    maintenance.schedule(application)
+    
+    return application
+
+def main():
+    # Инициализируем базу данных при запуске
+    db.init_database()
+    
+    # Удаляем файлы, на которые больше не ссылаются документы
+    collect_garbage(db.get_connection())
+    
+    application = build_application()
+    
     print("Бот адвоката запущен...")
-    application.run_polling()
+    try:
+        application.run_polling()
+    finally:
+        resources.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+
+import asyncio
+import functools
+import logging
+import time
+
+import secrets as _secrets
+
+import db
+from rate_limiter import send_limiter
+
+# Необязательные настройки из secrets.py
+MAIL_WORKERS = getattr(_secrets, 'MAIL_WORKERS', 2)
+MAIL_MAX_ATTEMPTS = getattr(_secrets, 'MAIL_MAX_ATTEMPTS', 5)
+MAIL_RETRY_BASE = getattr(_secrets, 'MAIL_RETRY_BASE', 5)      # секунд до первой повторной попытки
+MAIL_RETRY_MAX = getattr(_secrets, 'MAIL_RETRY_MAX', 120)      # предельная пауза между попытками
+MAIL_POLL_INTERVAL = getattr(_secrets, 'MAIL_POLL_INTERVAL', 5)
+MAIL_BATCH_SIZE = getattr(_secrets, 'MAIL_BATCH_SIZE', 5)       # писем на один домен за одну SMTP-сессию
+MAIL_BATCH_WINDOW = getattr(_secrets, 'MAIL_BATCH_WINDOW', 0)   # секунд ждать попутных писем на тот же домен
+MAIL_METRICS_INTERVAL = getattr(_secrets, 'MAIL_METRICS_INTERVAL', 300)
+
+def email_domain(address):
+    """Домен адреса получателя в нижнем регистре"""
+    return address.rpartition('@')[2].lower()
+
+class MailQueue:
+    """Очередь писем с кодами, сохраняемая в SQLite
+
+    Обработчики ставят письмо в очередь и сразу отвечают пользователю.
+    Фоновые задачи забирают письма из таблицы outbox, отправляют их вне
+    event loop и при ошибке повторяют попытку с экспоненциальной паузой.
+    Письма на один домен, накопившиеся в очереди, уходят пачкой через одну
+    SMTP-сессию с учетом ограничения скорости.
+    Письма, не отправленные до остановки бота, будут отправлены после запуска.
+    Шаблоны писем и пул SMTP загружаются при первой отправке.
+    """
+
+    def __init__(self, bot_name, build_message=None, send_batch=None,
+                 limiter=send_limiter, workers=MAIL_WORKERS,
+                 max_attempts=MAIL_MAX_ATTEMPTS, retry_base=MAIL_RETRY_BASE,
+                 retry_max=MAIL_RETRY_MAX, poll_interval=MAIL_POLL_INTERVAL,
+                 batch_size=MAIL_BATCH_SIZE, batch_window=MAIL_BATCH_WINDOW):
+        self.bot_name = bot_name
+        self.build_message = build_message
+        self.send_batch = send_batch
+        self.sender = None
+        self.limiter = limiter
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.on_failure = None
+        self._tasks = []
+        self._wakeup = asyncio.Event()
+        self._unreleased = set()   # id забранных писем, которые не удалось вернуть в очередь
+
+    async def enqueue(self, chat_id, document_id, to_email, code, name=None):
+        """Ставит письмо с кодом в очередь и возвращает его id"""
+        mail_id = await db.write_async(db.enqueue_mail, self.bot_name, chat_id, document_id,
+                                       to_email, code, name)
+        self._wakeup.set()
+        return mail_id
+
+    async def start(self, on_failure=None):
+        """Запускает фоновые задачи отправки
+
+        on_failure(chat_id, document_id, to_email) вызывается, когда
+        попытки отправки письма исчерпаны.
+        """
+        self.on_failure = on_failure
+        stuck = await db.write_async(db.reset_stuck_mail, self.bot_name)
+        if stuck:
+            logging.info(f"Возвращено в очередь писем после прерванной отправки: {stuck}")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._report_metrics()))
+
+    async def stop(self):
+        """Останавливает фоновые задачи; неотправленные письма остаются в очереди"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def metrics(self):
+        """Писем в очереди и метрики ограничителя скорости"""
+        metrics = self.limiter.metrics()
+        metrics['queued'] = await db.read_async(db.count_queued_mail, self.bot_name)
+        return metrics
+
+    async def _report_metrics(self):
+        """Периодически пишет метрики очереди в лог"""
+        while True:
+            await asyncio.sleep(MAIL_METRICS_INTERVAL)
+            try:
+                metrics = await self.metrics()
+            except Exception as e:
+                logging.error(f"Ошибка чтения метрик очереди писем: {e}")
+                continue
+            logging.info(
+                f"Очередь писем: в очереди {metrics['queued']}, ждут лимита {metrics['queue_depth']}, "
+                f"отправлено {metrics['sent']}, ожидание лимита в среднем {metrics['wait_avg']:.2f} с, "
+                f"максимум {metrics['wait_max']:.2f} с"
+            )
+
+    async def _worker(self):
+        """Забирает письма из очереди, пока она не опустеет, затем ждет новых"""
+        while True:
+            self._wakeup.clear()
+            if self._unreleased:
+                await self._release(list(self._unreleased))
+            try:
+                mails = await db.write_async(db.claim_mail, self.bot_name, time.time())
+                if mails and self.batch_size > 1:
+                    # Попутные письма на тот же домен уйдут через ту же сессию
+                    domain = email_domain(mails[0][3])
+                    if self.batch_window:
+                        await asyncio.sleep(self.batch_window)
+                    mails += await db.write_async(db.claim_mail, self.bot_name, time.time(),
+                                                  domain, self.batch_size - 1)
+            except Exception as e:
+                logging.error(f"Ошибка чтения очереди писем: {e}")
+                mails = []
+
+            if not mails:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                await self._deliver(mails)
+            except Exception as e:
+                logging.error(f"Ошибка отправки пачки из {len(mails)} писем: {e}")
+                # Письма, результат которых не записан, остались в статусе sending
+                await self._release([mail[0] for mail in mails])
+
+    async def _release(self, mail_ids):
+        """Возвращает забранные письма в очередь; при ошибке повторит на следующем проходе"""
+        try:
+            await db.write_async(db.release_mail, mail_ids)
+        except Exception as e:
+            logging.error(f"Ошибка возврата {len(mail_ids)} писем в очередь: {e}")
+            self._unreleased.update(mail_ids)
+        else:
+            self._unreleased.difference_update(mail_ids)
+
+    def _load_mailer(self):
+        """Загружает email_templates и smtp_pool; выполняется вне event loop"""
+        from email_templates import SENDER, build_code_email
+        from smtp_pool import smtp_pool
+
+        if self.build_message is None:
+            self.build_message = functools.partial(build_code_email, self.bot_name)
+        if self.send_batch is None:
+            self.send_batch = smtp_pool.send_batch
+        self.sender = SENDER
+
+    async def _deliver(self, mails):
+        """Отправляет пачку писем на один домен и записывает результаты"""
+        if self.sender is None:
+            await asyncio.to_thread(self._load_mailer)
+        await self.limiter.acquire(email_domain(mails[0][3]), len(mails))
+
+        built, messages = [], []
+        for mail in mails:
+            _, _, _, to_email, code, name, _ = mail
+            try:
+                messages.append(([to_email], self.build_message(to_email, code, name)))
+                built.append(mail)
+            except Exception as e:
+                await self._failed(mail, e)
+
+        try:
+            errors = await asyncio.to_thread(self.send_batch, self.sender, messages)
+        except Exception as e:
+            errors = [e] * len(messages)
+
+        for mail, error in zip(built, errors):
+            if error is not None:
+                await self._failed(mail, error)
+                continue
+            await db.write_async(db.mark_mail_sent, mail[0])
+            logging.info(f"Код отправлен на {mail[3]}")
+
+    async def _failed(self, mail, error):
+        """Планирует повторную попытку или, если попытки исчерпаны, уведомляет пользователя"""
+        mail_id, chat_id, document_id, to_email, _, _, attempts = mail
+        attempts += 1
+        if attempts < self.max_attempts:
+            delay = min(self.retry_base * 2 ** (attempts - 1), self.retry_max)
+            logging.warning(f"Ошибка отправки email на {to_email} (попытка {attempts}), "
+                            f"повтор через {delay} с: {error}")
+            await db.write_async(db.schedule_mail_retry, mail_id, time.time() + delay, str(error))
+            return
+
+        logging.error(f"Не удалось отправить email на {to_email} после {attempts} попыток: {error}")
+        await db.write_async(db.mark_mail_failed, mail_id, str(error))
+        if self.on_failure is not None:
+            try:
+                await self.on_failure(chat_id, document_id, to_email)
+            except Exception as notify_error:
+                logging.error(f"Ошибка уведомления о неотправленном письме: {notify_error}")
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""Периодическое обслуживание базы и хранилища документов
+
+Задача JobQueue бота адвоката (один раз на базу, даже если оба бота
+работают в одном процессе):
+- удаляет пачками коды подписи, истекшие больше CODE_RETENTION назад;
+- удаляет пачками отправленные и неотправленные письма старше MAIL_RETENTION;
+- удаляет пачками записи журнала изменений (change_log) старше CHANGE_LOG_RETENTION;
+- удаляет файлы прежних версий документов, на которые больше нет ссылок
+  дольше BLOB_RETENTION (сборщик мусора хранилища);
+- возвращает свободные страницы файлу базы (incremental_vacuum)
+  и выполняет PRAGMA optimize.
+
+Разовый запуск: python3 maintenance.py
+"""
+
+import asyncio
+import logging
+import time
+
+import secrets as _secrets
+
+import db
+from document_store import ORPHAN_GRACE_SECONDS, collect_garbage
+
+# Необязательные настройки из secrets.py
+MAINTENANCE_INTERVAL = getattr(_secrets, 'MAINTENANCE_INTERVAL', 6 * 60 * 60)   # секунд между запусками
+MAINTENANCE_FIRST = getattr(_secrets, 'MAINTENANCE_FIRST', 10 * 60)             # первый запуск после старта
+MAINTENANCE_BATCH_SIZE = getattr(_secrets, 'MAINTENANCE_BATCH_SIZE', 500)        # строк за одну транзакцию
+CODE_RETENTION = getattr(_secrets, 'CODE_RETENTION', 7 * 24 * 60 * 60)
+MAIL_RETENTION = getattr(_secrets, 'MAIL_RETENTION', 7 * 24 * 60 * 60)
+CHANGE_LOG_RETENTION = getattr(_secrets, 'CHANGE_LOG_RETENTION', 24 * 60 * 60)
+BLOB_RETENTION = getattr(_secrets, 'BLOB_RETENTION', ORPHAN_GRACE_SECONDS)
+
+async def _purge(query, retention_seconds, batch_size):
+    """Удаляет строки пачками; между пачками поток-писатель выполняет другие записи"""
+    total = 0
+    while True:
+        deleted = await db.write_async(query, retention_seconds, batch_size)
+        total += deleted
+        if deleted < batch_size:
+            return total
+
+async def run_maintenance(batch_size=MAINTENANCE_BATCH_SIZE):
+    """Выполняет все шаги обслуживания и возвращает отчет"""
+    started = time.monotonic()
+    report = {
+        'codes': await _purge(db.purge_expired_codes, CODE_RETENTION, batch_size),
+        'mail': await _purge(db.purge_finished_mail, MAIL_RETENTION, batch_size),
+        'changes': await _purge(db.purge_change_log, CHANGE_LOG_RETENTION, batch_size),
+    }
+    report['blobs'], report['blob_bytes'] = await db.connection_async(collect_garbage, BLOB_RETENTION)
+    report['db_bytes'] = await db.write_async(db.compact_database)
+    report['seconds'] = time.monotonic() - started
+
+    logging.info(
+        f"Обслуживание: удалено кодов {report['codes']}, писем {report['mail']}, "
+        f"записей журнала изменений {report['changes']}, "
+        f"файлов {report['blobs']} ({report['blob_bytes']} байт), "
+        f"база уменьшилась на {report['db_bytes']} байт за {report['seconds']:.2f} с"
+    )
+    return report
+
+async def maintenance_job(context):
+    """Задача JobQueue"""
+    try:
+        await run_maintenance()
+    except Exception as e:
+        logging.error(f"Ошибка обслуживания базы: {e}")
+
+def schedule(application):
+    """Добавляет обслуживание в JobQueue приложения"""
+    if application.job_queue is None:
+        logging.warning("JobQueue недоступна: установите python-telegram-bot[job-queue]; обслуживание базы отключено")
+        return
+    application.job_queue.run_repeating(
+        maintenance_job, interval=MAINTENANCE_INTERVAL, first=MAINTENANCE_FIRST, name='maintenance'
+    )
+
+def main():
+    db.init_database()
+    try:
+        report = asyncio.run(run_maintenance())
+    finally:
+        db.shutdown()
+    print(f"Удалено кодов: {report['codes']}, писем: {report['mail']}, "
+          f"записей журнала изменений: {report['changes']}, файлов: {report['blobs']}")
+    print(f"Освобождено: файлы {report['blob_bytes']} байт, база {report['db_bytes']} байт")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
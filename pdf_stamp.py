@@ -1,90 +1,134 @@
 #!/usr/bin/env python3
 
-import os
+import functools
+import hashlib
+import io
+import shutil
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from PyPDF2 import PdfReader, PdfWriter
-from datetime import datetime
-import hashlib
+from PyPDF2.generic import (
+    ArrayObject, ByteStringObject, DecodedStreamObject, DictionaryObject, IndirectObject,
+    NameObject, NumberObject, StreamObject,
+)
+
+from document_store import HashingWriter
+
+# Имя Form XObject штампа на последней странице (для инкрементального режима)
+STAMP_XOBJECT_NAME = NameObject('/DocBotSignatureStamp')
+
+# Размер блока при копировании исходного PDF
+COPY_CHUNK_SIZE = 1024 * 1024
+
+def _write_output(data, output):
+    """Записывает байты PDF в путь или файловый объект"""
+    if hasattr(output, 'write'):
+        output.write(data)
+    else:
+        with open(output, 'wb') as output_file:
+            output_file.write(data)
+
+# Шрифты штампа
+FONT_REGULAR = 'DejaVuSans'
+FONT_BOLD = 'DejaVuSans-Bold'
+FONT_FILES = {
+    FONT_REGULAR: '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+    FONT_BOLD: '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf',
+}
+FONT_SIZE = 7
+STAMP_COLOR = (0.56, 0.66, 0.86)  # #8FA8DB в RGB
+
+_fonts_registered = False
+
+def _register_fonts():
+    """Регистрирует шрифты один раз на процесс"""
+    global _fonts_registered
+    if not _fonts_registered:
+        for font_name, font_path in FONT_FILES.items():
+            pdfmetrics.registerFont(TTFont(font_name, font_path))
+        _fonts_registered = True
 
-def generate_document_hash(client_id, document_name):
-    """Генерирует уникальный хеш документа"""
-    unique_string = f"{client_id}_{document_name}_{datetime.now().timestamp()}"
-    return hashlib.md5(unique_string.encode()).hexdigest()
+@functools.lru_cache(maxsize=None)
+def _stamp_template(lawyer_signed, client_signed):
+    """Предрассчитывает рамку и строки штампа для набора подписей
 
-def create_signature_stamp(signature_data, output_path):
-    """Создает PDF с правильным штампом подписи"""
-    c = canvas.Canvas(output_path, pagesize=A4)
-    width, height = A4
+    Возвращает рамку (x, y, ширина, высота) и строки (шрифт, x, y, текст),
+    где в тексте остаются только поля для подстановки переменных данных.
+    """
+    # Параметры штампа
+    stamp_width = 303  # 8.58 см
+    stamp_x = 54       # 1.91 см от левого края
+    stamp_y = 50       # от нижнего края
+
+    lines = [
+        (FONT_BOLD, "Документ подписан простой электронной подписью"),
+        (FONT_REGULAR, "ID документа: {document_hash}"),
+    ]
+
+    # Подпись адвоката
+    if lawyer_signed:
+        lines += [
+            (FONT_BOLD, "Адвокат"),
+            (FONT_REGULAR, "Подписант: {lawyer_name}"),
+            (FONT_REGULAR, "Дата и время подписи: {lawyer_sign_date} MSK"),
+        ]
+
+    # Подпись клиента
+    if client_signed:
+        lines += [
+            (FONT_BOLD, "Клиент"),
+            (FONT_REGULAR, "Подписант: {client_name}"),
+            (FONT_REGULAR, "Дата и время подписи: {client_sign_date} MSK"),
+        ]
+
+    # Высота штампа: базовые 3 строки плюс по 3 на каждую подпись
+    line_height = 7
+    num_lines = 3 + 3 * bool(lawyer_signed) + 3 * bool(client_signed)
+    stamp_height = num_lines * line_height + 20
+
+    text_x = stamp_x + 8  # 0.2 см от левого края рамки
+    top_y = stamp_y + stamp_height - 10  # отступ сверху
+    placed_lines = tuple(
+        (font_name, text_x, top_y - index * line_height, text)
+        for index, (font_name, text) in enumerate(lines)
+    )
+    return (stamp_x, stamp_y, stamp_width, stamp_height), placed_lines
+
+def create_signature_stamp(signature_data, output=None):
+    """Создает PDF с правильным штампом подписи в памяти и возвращает его байты"""
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer, pagesize=A4)
 
     try:
-        # Регистрируем шрифты
-        pdfmetrics.registerFont(TTFont('DejaVuSans', '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'))
-        pdfmetrics.registerFont(TTFont('DejaVuSans-Bold', '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf'))
-        
-        # Параметры штампа
-        stamp_width = 303  # 8.58 см
-        stamp_x = 54       # 1.91 см от левого края
-        stamp_y = 50       # от нижнего края
-        
-        # Рассчитываем высоту штампа
-        line_height = 7    # высота строки
-        num_lines = 3      # базовые строки
-        
-        if signature_data.get('lawyer_signed'):
-            num_lines += 3  # адвокат: заголовок + 2 строки
-            
-        if signature_data.get('client_signed'):
-            num_lines += 3  # клиент: заголовок + 2 строки
-            
-        stamp_height = num_lines * line_height + 20  # общая высота
-        
+        _register_fonts()
+        frame, lines = _stamp_template(
+            bool(signature_data.get('lawyer_signed')),
+            bool(signature_data.get('client_signed'))
+        )
+        values = {
+            'document_hash': signature_data['document_hash'],
+            'lawyer_name': signature_data.get('lawyer_name', ''),
+            'lawyer_sign_date': signature_data.get('lawyer_sign_date', ''),
+            'client_name': signature_data.get('client_name', ''),
+            'client_sign_date': signature_data.get('client_sign_date', ''),
+        }
+
         # Рамка штампа
-        c.setStrokeColorRGB(0.56, 0.66, 0.86)  # #8FA8DB в RGB
+        c.setStrokeColorRGB(*STAMP_COLOR)
         c.setLineWidth(1.5)
-        c.rect(stamp_x, stamp_y, stamp_width, stamp_height)
-        
+        c.rect(*frame)
+
         # Текст штампа
-        c.setFillColorRGB(0.56, 0.66, 0.86)  # #8FA8DB в RGB
-        text_x = stamp_x + 8  # 0.2 см от левого края рамки
-        current_y = stamp_y + stamp_height - 10  # отступ сверху
-        
-        # Основной текст
-        c.setFont("DejaVuSans-Bold", 7)
-        c.drawString(text_x, current_y, "Документ подписан простой электронной подписью")
-        current_y -= line_height
-        
-        c.setFont("DejaVuSans", 7)
-        c.drawString(text_x, current_y, f"ID документа: {signature_data['document_hash']}")
-        current_y -= line_height
-        
-        # Подпись адвоката
-        if signature_data.get('lawyer_signed'):
-            c.setFont("DejaVuSans-Bold", 7)
-            c.drawString(text_x, current_y, "Адвокат")
-            current_y -= line_height
-            
-            c.setFont("DejaVuSans", 7)
-            c.drawString(text_x, current_y, f"Подписант: {signature_data.get('lawyer_name', '')}")
-            current_y -= line_height
-            
-            c.drawString(text_x, current_y, f"Дата и время подписи: {signature_data.get('lawyer_sign_date', '')} MSK")
-            current_y -= line_height
-        
-        # Подпись клиента
-        if signature_data.get('client_signed'):
-            c.setFont("DejaVuSans-Bold", 7)
-            c.drawString(text_x, current_y, "Клиент")
-            current_y -= line_height
-            
-            c.setFont("DejaVuSans", 7)
-            c.drawString(text_x, current_y, f"Подписант: {signature_data.get('client_name', '')}")
-            current_y -= line_height
-            
-            c.drawString(text_x, current_y, f"Дата и время подписи: {signature_data.get('client_sign_date', '')} MSK")
-            
+        c.setFillColorRGB(*STAMP_COLOR)
+        current_font = None
+        for font_name, text_x, text_y, text in lines:
+            if font_name != current_font:
+                c.setFont(font_name, FONT_SIZE)
+                current_font = font_name
+            c.drawString(text_x, text_y, text.format(**values))
+
     except Exception as e:
         print(f"Ошибка создания штампа: {e}")
         # Английский fallback
@@ -92,56 +136,334 @@ def create_signature_stamp(signature_data, output_path):
         c.drawString(50, 50, f"Document ID: {signature_data['document_hash']}")
 
     c.save()
+    stamp_data = buffer.getvalue()
+
+    if output is not None:
+        _write_output(stamp_data, output)
+    return stamp_data
+
+def _open_source(original_pdf):
+    """Открывает исходный PDF как поток; возвращает поток и признак, что его нужно закрыть"""
+    if isinstance(original_pdf, (bytes, bytearray)):
+        return io.BytesIO(original_pdf), True
+    if hasattr(original_pdf, 'read'):
+        return original_pdf, False
+    return open(original_pdf, 'rb'), True
+
+def _read_tail(source, size=1024):
+    """Читает последние байты потока и возвращает их вместе с размером потока"""
+    source.seek(0, io.SEEK_END)
+    total_size = source.tell()
+    source.seek(max(0, total_size - size))
+    return source.read(), total_size
+
+def _find_startxref(pdf_tail):
+    """Находит смещение последней таблицы xref"""
+    position = pdf_tail.rfind(b'startxref')
+    if position == -1:
+        raise ValueError("В PDF не найден startxref")
+    return int(pdf_tail[position + len(b'startxref'):].split()[0])
+
+def _uses_xref_stream(source, xref_offset):
+    """Последняя ревизия PDF описана потоком перекрестных ссылок, а не таблицей xref"""
+    source.seek(xref_offset)
+    return not source.read(32).lstrip().startswith(b'xref')
+
+def _next_object_id(reader):
+    """Первый свободный номер объекта
+
+    Для документов с потоком перекрестных ссылок PyPDF2 не переносит /Size
+    в trailer, поэтому номер определяется по разобранным ссылкам.
+    """
+    if '/Size' in reader.trailer:
+        return int(reader.trailer['/Size'])
+    ids = [idnum for section in reader.xref.values() for idnum in section]
+    ids += list(reader.xref_objStm)
+    return max(ids, default=0) + 1
+
+def _xref_runs(ids):
+    """Разбивает отсортированные номера объектов на непрерывные участки"""
+    runs = []
+    for idnum in ids:
+        if runs and idnum == runs[-1][-1] + 1:
+            runs[-1].append(idnum)
+        else:
+            runs.append([idnum])
+    return runs
+
+# Атрибуты страницы, которые наследуются от узлов дерева страниц
+INHERITABLE_PAGE_KEYS = ('/Resources', '/MediaBox', '/CropBox', '/Rotate')
+
+def _last_page(reader):
+    """Находит последнюю страницу спуском по дереву страниц
+
+    В отличие от reader.pages не разбирает остальные страницы, поэтому
+    стоимость не зависит от их количества. Возвращает ссылку на страницу,
+    ее словарь и унаследованные от родительских узлов атрибуты.
+    """
+    node = reader.trailer['/Root']['/Pages']
+    inherited = {}
+    while node.get('/Type') != '/Page' and '/Kids' in node:
+        for key in INHERITABLE_PAGE_KEYS:
+            if key in node:
+                inherited[key] = node.raw_get(key)
+        # Берем последний непустой дочерний узел, разбирая только хвост списка
+        for page_ref in reversed(node['/Kids']):
+            if page_ref.get_object().get('/Count', 1) > 0:
+                break
+        else:
+            raise ValueError("В PDF нет страниц")
+        node = page_ref.get_object()
+
+    if node.get('/Type') != '/Page':
+        raise ValueError("Не удалось найти последнюю страницу")
+    return page_ref, node, inherited
+
+class _ObjectImporter:
+    """Переносит объекты штампа в новую ревизию исходного PDF с новыми номерами"""
+
+    def __init__(self, first_id):
+        self.next_id = first_id
+        self.id_map = {}
+        self.objects = []
+
+    def add(self, obj):
+        """Регистрирует новый косвенный объект и возвращает ссылку на него"""
+        ref = IndirectObject(self.next_id, 0, None)
+        self.objects.append((self.next_id, 0, obj))
+        self.next_id += 1
+        return ref
+
+    def import_object(self, obj):
+        """Рекурсивно копирует объект, перенумеровывая косвенные ссылки"""
+        if isinstance(obj, IndirectObject):
+            key = (obj.idnum, obj.generation)
+            if key not in self.id_map:
+                ref = self.add(None)
+                self.id_map[key] = ref
+                index = len(self.objects) - 1
+                self.objects[index] = (ref.idnum, 0, self.import_object(obj.get_object()))
+            return self.id_map[key]
 
-def add_signature_to_pdf(original_pdf_path, signature_data, output_pdf_path):
-    """Добавляет штамп подписи в существующий PDF"""
+        if isinstance(obj, StreamObject):
+            copy = obj.__class__()
+            copy._data = obj._data
+        elif isinstance(obj, DictionaryObject):
+            copy = DictionaryObject()
+        elif isinstance(obj, ArrayObject):
+            return ArrayObject(self.import_object(item) for item in obj)
+        else:
+            return obj
+
+        for key, value in obj.items():
+            copy[NameObject(key)] = self.import_object(value)
+        return copy
+
+def _content_refs(page):
+    """Возвращает список ссылок на потоки содержимого страницы"""
+    contents = page.raw_get('/Contents') if '/Contents' in page else None
+    if contents is None:
+        return []
+    if isinstance(contents, IndirectObject) and isinstance(contents.get_object(), ArrayObject):
+        contents = contents.get_object()
+    if isinstance(contents, ArrayObject):
+        return list(contents)
+    return [contents]
+
+def _new_stream(data):
+    """Создает сжатый поток содержимого"""
+    stream = DecodedStreamObject()
+    stream.set_data(data)
+    return stream.flate_encode()
+
+def build_incremental_update(source, signature_data):
+    """Строит секцию инкрементального обновления PDF со штампом на последней странице
+
+    source - поток с исходным PDF. Возвращает байты, которые нужно дописать в его
+    конец. Исходные байты документа не меняются: новая ревизия содержит только
+    измененную последнюю страницу и объекты штампа. Если штамп уже был добавлен
+    этим же способом, он заменяется новым, а не накладывается поверх.
+    """
+    tail, base_offset = _read_tail(source)
+    source.seek(0)
+    original = PdfReader(source)
+    if original.is_encrypted:
+        raise ValueError("Инкрементальное обновление зашифрованных PDF не поддерживается")
+
+    page_ref, page, inherited = _last_page(original)
+    importer = _ObjectImporter(_next_object_id(original))
+
+    # Штамп переносится в документ как Form XObject
+    stamp_page = PdfReader(io.BytesIO(create_signature_stamp(signature_data))).pages[0]
+    stamp_form = _new_stream(stamp_page.get_contents().get_data())
+    stamp_form.update({
+        NameObject('/Type'): NameObject('/XObject'),
+        NameObject('/Subtype'): NameObject('/Form'),
+        NameObject('/BBox'): ArrayObject(stamp_page.mediabox),
+        NameObject('/Resources'): importer.import_object(stamp_page.raw_get('/Resources')),
+    })
+    stamp_ref = importer.add(stamp_form)
+
+    # Новая версия последней страницы с тем же номером объекта
+    new_page = DictionaryObject(page.items())
+    if '/Resources' in page:
+        resources = DictionaryObject(page['/Resources'].items())
+    elif '/Resources' in inherited:
+        resources = DictionaryObject(inherited['/Resources'].get_object().items())
+    else:
+        resources = DictionaryObject()
+    xobjects = DictionaryObject(resources['/XObject'].items()) if '/XObject' in resources else DictionaryObject()
+    already_stamped = STAMP_XOBJECT_NAME in xobjects
+    xobjects[STAMP_XOBJECT_NAME] = stamp_ref
+    resources[NameObject('/XObject')] = xobjects
+    new_page[NameObject('/Resources')] = resources
+
+    if not already_stamped:
+        # Исходное содержимое оборачивается в q/Q, чтобы его графическое состояние не влияло на штамп
+        prefix_ref = importer.add(_new_stream(b"q\n"))
+        suffix_ref = importer.add(_new_stream(b"Q\nq " + STAMP_XOBJECT_NAME.encode() + b" Do Q\n"))
+        new_page[NameObject('/Contents')] = ArrayObject([prefix_ref] + _content_refs(page) + [suffix_ref])
+
+    objects = [(page_ref.idnum, page_ref.generation, new_page)] + importer.objects
+
+    # Сериализуем объекты, таблицу xref и трейлер с /Prev на предыдущую ревизию
+    update = io.BytesIO()
+    if not tail.endswith(b'\n'):
+        update.write(b'\n')
+
+    offsets = {}
+    for idnum, generation, obj in objects:
+        offsets[idnum] = (base_offset + update.tell(), generation)
+        update.write(f"{idnum} {generation} obj\n".encode())
+        obj.write_to_stream(update, None)
+        update.write(b"\nendobj\n")
+
+    prev_offset = _find_startxref(tail)
+    trailer = DictionaryObject({
+        NameObject('/Root'): original.trailer.raw_get('/Root'),
+        NameObject('/Prev'): NumberObject(prev_offset),
+    })
+    if '/Info' in original.trailer:
+        trailer[NameObject('/Info')] = original.trailer.raw_get('/Info')
+    if '/ID' in original.trailer:
+        # Первая часть идентификатора постоянна, вторая меняется с каждой ревизией
+        first_id = original.trailer['/ID'][0]
+        if not isinstance(first_id, bytes):
+            # PyPDF2 читает часть строк как текст; в файл пишутся исходные байты
+            first_id = first_id.original_bytes
+        revision_id = hashlib.md5(update.getvalue() + str(base_offset).encode()).digest()
+        trailer[NameObject('/ID')] = ArrayObject([ByteStringObject(first_id), ByteStringObject(revision_id)])
+
+    xref_offset = base_offset + update.tell()
+    if _uses_xref_stream(source, prev_offset):
+        # Документ с потоками перекрестных ссылок дополняется тоже потоком:
+        # таблица xref в такой ревизии дала бы гибридный файл
+        xref_id = importer.next_id
+        offsets[xref_id] = (xref_offset, 0)
+        ids = sorted(offsets)
+        offset_width = max(4, (xref_offset.bit_length() + 7) // 8)
+        data = b''.join(
+            b'\x01' + offsets[idnum][0].to_bytes(offset_width, 'big') + offsets[idnum][1].to_bytes(2, 'big')
+            for idnum in ids
+        )
+        trailer.update({
+            NameObject('/Type'): NameObject('/XRef'),
+            NameObject('/Size'): NumberObject(max(xref_id + 1, page_ref.idnum + 1)),
+            NameObject('/W'): ArrayObject([NumberObject(1), NumberObject(offset_width), NumberObject(2)]),
+            NameObject('/Index'): ArrayObject(
+                NumberObject(number) for run in _xref_runs(ids) for number in (run[0], len(run))
+            ),
+        })
+        xref_stream = _new_stream(data)
+        xref_stream.update(trailer)
+        update.write(f"{xref_id} 0 obj\n".encode())
+        xref_stream.write_to_stream(update, None)
+        update.write(b"\nendobj\n")
+    else:
+        # Нулевая запись (голова списка свободных объектов) нужна части читателей
+        update.write(b"xref\n0 1\n0000000000 65535 f\r\n")
+        for run in _xref_runs(sorted(offsets)):
+            update.write(f"{run[0]} {len(run)}\n".encode())
+            for idnum in run:
+                offset, generation = offsets[idnum]
+                update.write(f"{offset:010d} {generation:05d} n\r\n".encode())
+
+        trailer[NameObject('/Size')] = NumberObject(max(importer.next_id, page_ref.idnum + 1))
+        update.write(b"trailer\n")
+        trailer.write_to_stream(update, None)
+        update.write(b"\n")
+
+    update.write(f"startxref\n{xref_offset}\n%%EOF\n".encode())
+    return update.getvalue()
+
+def _rewrite_with_stamp(source, signature_data, output_stream):
+    """Пересобирает весь документ через PdfWriter со штампом на последней странице
+
+    Запасной путь для PDF, которые нельзя дополнить инкрементально. Штамп
+    накладывается только на последнюю страницу, но каждая страница
+    переносится в новый файл, поэтому время растет с числом страниц;
+    не зависит от него только режим incremental.
+    """
+    # Штамп рендерится в память, без временных файлов
+    stamp_pdf = PdfReader(io.BytesIO(create_signature_stamp(signature_data)))
+    original = PdfReader(source)
+
+    pages = original.pages
+    pages[len(pages) - 1].merge_page(stamp_pdf.pages[0])
+
+    writer = PdfWriter()
+    writer.append_pages_from_reader(original)
+    writer.write(output_stream)
+
+def write_stamped_pdf(original_pdf, signature_data, output_stream, incremental=False):
+    """Записывает PDF со штампом в output_stream
+
+    original_pdf может быть путем к файлу, байтами или файловым объектом.
+    В режиме incremental исходные байты копируются в выход блоками без
+    разбора страниц, а штамп дописывается инкрементальным обновлением,
+    поэтому время и память почти не зависят от числа страниц.
+    """
+    source, owned = _open_source(original_pdf)
     try:
-        # Создаем временный файл со штампом
-        stamp_path = "/tmp/signature_stamp.pdf"
-        create_signature_stamp(signature_data, stamp_path)
-        
-        # Открываем оригинальный PDF и штамп
-        original_pdf = PdfReader(original_pdf_path)
-        stamp_pdf = PdfReader(stamp_path)
-        
-        # Создаем writer для нового PDF
-        writer = PdfWriter()
-        
-        # Для каждой страницы добавляем штамп
-        for page_num in range(len(original_pdf.pages)):
-            page = original_pdf.pages[page_num]
-            
-            # Если это последняя страница - добавляем штамп
-            if page_num == len(original_pdf.pages) - 1:
-                stamp_page = stamp_pdf.pages[0]
-                page.merge_page(stamp_page)
-            
-            writer.add_page(page)
-        
-        # Сохраняем результат
-        with open(output_pdf_path, 'wb') as output_file:
-            writer.write(output_file)
-        
-        # Удаляем временный файл
-        os.remove(stamp_path)
-        return True
-        
-    except Exception as e:
-        print(f"Ошибка при добавлении штампа: {e}")
-        return False
+        if incremental:
+            try:
+                update = build_incremental_update(source, signature_data)
+            except ValueError as e:
+                print(f"Инкрементальный режим недоступен, документ будет пересобран: {e}")
+            else:
+                source.seek(0)
+                shutil.copyfileobj(source, output_stream, COPY_CHUNK_SIZE)
+                output_stream.write(update)
+                return
+            source.seek(0)
 
-def update_document_hash_in_db(document_id, document_hash):
-    """Обновляет хеш документа в базе данных"""
-    import sqlite3
-    conn = sqlite3.connect('/opt/bots/documents.db')
-    cursor = conn.cursor()
+        _rewrite_with_stamp(source, signature_data, output_stream)
+    finally:
+        if owned:
+            source.close()
+
+def stamp_pdf_bytes(original_pdf, signature_data, incremental=False):
+    """Накладывает штамп на последнюю страницу и возвращает итоговый PDF в байтах"""
+    result = io.BytesIO()
+    write_stamped_pdf(original_pdf, signature_data, result, incremental)
+    return result.getvalue()
+
+def add_signature_to_pdf(original_pdf, signature_data, output_pdf, incremental=False):
+    """Добавляет штамп подписи в существующий PDF
+
+    output_pdf может быть путем к файлу или файловым объектом.
+    Возвращает SHA-256 записанного PDF, посчитанный при записи, или False при ошибке.
+    """
     try:
-        cursor.execute(
-            "UPDATE documents SET document_hash = ? WHERE id = ?",
-            (document_hash, document_id)
-        )
-        conn.commit()
+        if hasattr(output_pdf, 'write'):
+            output = HashingWriter(output_pdf)
+            write_stamped_pdf(original_pdf, signature_data, output, incremental)
+        else:
+            with open(output_pdf, 'wb') as output_file:
+                output = HashingWriter(output_file)
+                write_stamped_pdf(original_pdf, signature_data, output, incremental)
+        return output.hexdigest()
+
     except Exception as e:
-        print(f"Ошибка при обновлении хеша: {e}")
-    finally:
-        conn.close()
+        print(f"Ошибка при добавлении штампа: {e}")
+        return False
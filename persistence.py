@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+import asyncio
+import json
+import logging
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+import secrets as _secrets
+
+import db
+
+# Необязательная настройка из secrets.py: как часто сохранять изменения, секунд
+PERSISTENCE_INTERVAL = getattr(_secrets, 'PERSISTENCE_INTERVAL', 60)
+
+class SQLitePersistence(BasePersistence):
+    """user_data и состояния ConversationHandler в таблице persistence базы documents.db
+
+    Данные хранятся в JSON с ключом по имени бота, поэтому оба бота могут
+    работать с одной базой и в одном процессе. Application передает изменения
+    раз в update_interval секунд; все изменения одного прохода записываются
+    одной транзакцией через поток-писатель базы, а не по одной на обновление.
+    Пустые user_data и завершенные диалоги удаляются из таблицы.
+    """
+
+    def __init__(self, bot_name, update_interval=PERSISTENCE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.bot_name = bot_name
+        self._pending = {}    # (вид, ключ) -> данные в JSON или None для удаления
+        self._write_task = None
+
+    async def _load(self, kind):
+        rows = await db.read_async(db.load_persistence, self.bot_name, kind)
+        return {key: json.loads(data) for key, data in rows}
+
+    def _mark(self, kind, key, data):
+        """Запоминает изменение и планирует запись пачки"""
+        self._pending[(kind, key)] = None if data is None else json.dumps(data, ensure_ascii=False)
+        if self._write_task is None:
+            # update_persistence запускает все update_* одним asyncio.gather:
+            # они выполнятся раньше этой задачи и попадут в одну транзакцию
+            self._write_task = asyncio.create_task(self._write_pending())
+
+    async def _write_pending(self):
+        """Записывает накопленные изменения одной транзакцией"""
+        try:
+            while self._pending:
+                pending, self._pending = self._pending, {}
+                items = [(kind, key, data) for (kind, key), data in pending.items()]
+                try:
+                    await db.write_async(db.save_persistence, self.bot_name, items)
+                except Exception as e:
+                    # Более новые изменения тех же ключей важнее неудавшихся
+                    self._pending = {**pending, **self._pending}
+                    logging.error(f"Persistence {self.bot_name}: ошибка записи {len(items)} изменений: {e}")
+                    return
+        finally:
+            self._write_task = None
+
+    async def get_user_data(self):
+        return {int(key): data for key, data in (await self._load('user')).items()}
+
+    async def get_chat_data(self):
+        return {int(key): data for key, data in (await self._load('chat')).items()}
+
+    async def get_bot_data(self):
+        data = await self._load('bot')
+        return data.get('', {})
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        conversations = await self._load(f"conversation:{name}")
+        return {tuple(json.loads(key)): state for key, state in conversations.items()}
+
+    async def update_user_data(self, user_id, data):
+        self._mark('user', str(user_id), data or None)
+
+    async def update_chat_data(self, chat_id, data):
+        self._mark('chat', str(chat_id), data or None)
+
+    async def update_bot_data(self, data):
+        self._mark('bot', '', data or None)
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def update_conversation(self, name, key, new_state):
+        self._mark(f"conversation:{name}", json.dumps(list(key)), new_state)
+
+    async def drop_user_data(self, user_id):
+        self._mark('user', str(user_id), None)
+
+    async def drop_chat_data(self, chat_id):
+        self._mark('chat', str(chat_id), None)
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        """Дописывает изменения перед остановкой бота"""
+        if self._write_task is not None:
+            await self._write_task
+        if self._pending:
+            await self._write_pending()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+import asyncio
+import time
+
+import secrets as _secrets
+
+# Необязательные настройки из secrets.py: писем в секунду и размер всплеска
+SMTP_RATE = getattr(_secrets, 'SMTP_RATE', 5)
+SMTP_BURST = getattr(_secrets, 'SMTP_BURST', 10)
+SMTP_DOMAIN_RATE = getattr(_secrets, 'SMTP_DOMAIN_RATE', 1)
+SMTP_DOMAIN_BURST = getattr(_secrets, 'SMTP_DOMAIN_BURST', 5)
+# Отдельные лимиты для почтовых провайдеров: {'gmail.com': (rate, burst)}
+SMTP_DOMAIN_LIMITS = getattr(_secrets, 'SMTP_DOMAIN_LIMITS', {})
+
+class TokenBucket:
+    """Маркерная корзина: rate маркеров в секунду, не больше burst в запасе"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, tokens=1):
+        """Ждет, пока в корзине наберется tokens маркеров, и забирает их
+
+        Ожидающие обслуживаются по очереди. Больше burst маркеров в корзине
+        не бывает, поэтому большая пачка забирается частями не больше burst.
+        """
+        async with self._lock:
+            while tokens > 0:
+                part = min(tokens, self.burst)
+                self._refill()
+                while self.tokens < part:
+                    await asyncio.sleep((part - self.tokens) / self.rate)
+                    self._refill()
+                self.tokens -= part
+                tokens -= part
+
+class SendLimiter:
+    """Ограничение скорости отправки писем: общее и для каждого домена получателя
+
+    Корзины хранятся в памяти процесса. Если боты запущены отдельными
+    процессами (lawyer-bot и client-bot), каждый процесс соблюдает лимиты
+    сам по себе, и суммарная скорость до двух раз выше настроенной; общий
+    лимит на оба бота дает запуск одним процессом (run_bots.py, webhook.py).
+    """
+
+    def __init__(self, rate=SMTP_RATE, burst=SMTP_BURST, domain_rate=SMTP_DOMAIN_RATE,
+                 domain_burst=SMTP_DOMAIN_BURST, domain_limits=SMTP_DOMAIN_LIMITS):
+        self.bucket = TokenBucket(rate, burst)
+        self.domain_rate = domain_rate
+        self.domain_burst = domain_burst
+        self.domain_limits = domain_limits
+        self._domains = {}
+        # Метрики
+        self.waiting = 0
+        self.acquired = 0
+        self.wait_total = 0.0     # сумма ожиданий по всем письмам
+        self.wait_max = 0.0
+
+    def _domain_bucket(self, domain):
+        bucket = self._domains.get(domain)
+        if bucket is None:
+            rate, burst = self.domain_limits.get(domain, (self.domain_rate, self.domain_burst))
+            bucket = self._domains[domain] = TokenBucket(rate, burst)
+        return bucket
+
+    async def acquire(self, domain, count=1):
+        """Ждет разрешения отправить count писем на домен; возвращает время ожидания в секундах"""
+        started = time.monotonic()
+        self.waiting += count
+        try:
+            # Сначала домен: пока ждем медленного провайдера, общий лимит не занят
+            await self._domain_bucket(domain).acquire(count)
+            await self.bucket.acquire(count)
+        finally:
+            self.waiting -= count
+
+        waited = time.monotonic() - started
+        self.acquired += count
+        # Ждало каждое письмо пачки
+        self.wait_total += waited * count
+        self.wait_max = max(self.wait_max, waited)
+        return waited
+
+    def metrics(self):
+        """Глубина очереди ожидания и время ожидания разрешения на отправку одного письма"""
+        return {
+            'queue_depth': self.waiting,
+            'sent': self.acquired,
+            'wait_avg': self.wait_total / self.acquired if self.acquired else 0.0,
+            'wait_max': self.wait_max,
+        }
+
+send_limiter = SendLimiter()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""Ресурсы процесса, общие для обоих ботов
+
+Пулы соединений SQLite, SMTP-сессии и пул наложения штампов - синглтоны
+модулей. Когда оба бота работают в одном процессе (run_bots.py, webhook.py),
+они пользуются одними пулами, поэтому закрывать их нужно один раз,
+после остановки всех приложений, а не в post_shutdown каждого бота.
+
+Модули PDF (reportlab, PyPDF2) и почты (email, smtplib) при запуске
+не загружаются: их загружает первый штамп или письмо либо прогрев
+в фоне после начала приема обновлений.
+"""
+
+import asyncio
+import importlib
+import logging
+import sys
+import time
+
+import secrets as _secrets
+
+import db
+from stamp_service import stamp_service
+
+# Необязательные настройки из secrets.py
+WARMUP = getattr(_secrets, 'WARMUP', True)
+WARMUP_DELAY = getattr(_secrets, 'WARMUP_DELAY', 5)   # секунд после запуска до прогрева
+
+# Модули, которые нужны только при подписании
+LAZY_MODULES = ('pdf_stamp', 'email_templates', 'smtp_pool')
+
+_warm_up_task = None
+
+async def warm_up(delay=WARMUP_DELAY):
+    """Загружает модули PDF и почты в фоне, чтобы первая подпись не ждала импорта"""
+    await asyncio.sleep(delay)
+    started = time.monotonic()
+    for name in LAZY_MODULES:
+        if name not in sys.modules:
+            await asyncio.to_thread(importlib.import_module, name)
+    logging.info(f"Прогрев: модули PDF и почты загружены за {time.monotonic() - started:.2f} с")
+
+def schedule_warm_up():
+    """Запускает прогрев фоновой задачей, один раз на процесс"""
+    global _warm_up_task
+    if WARMUP and _warm_up_task is None:
+        _warm_up_task = asyncio.create_task(warm_up())
+
+async def stop_warm_up():
+    """Отменяет прогрев, если бот останавливается раньше, чем он закончился"""
+    global _warm_up_task
+    if _warm_up_task is not None:
+        _warm_up_task.cancel()
+        await asyncio.gather(_warm_up_task, return_exceptions=True)
+        _warm_up_task = None
+
+def close():
+    """Закрывает общие пулы; вызывается после остановки всех приложений"""
+    smtp_pool = sys.modules.get('smtp_pool')
+    if smtp_pool is not None:
+        smtp_pool.smtp_pool.close()
+    stamp_service.shutdown()
+    db.shutdown()
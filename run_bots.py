@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""Оба бота в одном процессе на одном event loop
+
+Вместо двух процессов (lawyer-bot.service и client-bot.service), каждый из
+которых загружает telegram, reportlab и PyPDF2 и открывает свои соединения
+с documents.db, оба Application работают в одном процессе и пользуются
+общими пулами SQLite, SMTP и штампов (см. resources.py). Запись в базу идет
+через один поток записи, поэтому боты не ждут блокировку SQLite друг друга.
+
+Запуск: python3 run_bots.py (служба bots.service).
+Раздельный запуск двух процессов по-прежнему доступен.
+"""
+
+import asyncio
+import logging
+import signal
+
+from telegram import Update
+
+import resources
+from webhook import start_applications, stop_applications
+
+def build_applications():
+    """Готовит базу и создает приложения обоих ботов"""
+    import db
+    import client_bot
+    import lawyer_bot
+    from document_store import collect_garbage
+
+    db.init_database()
+    collect_garbage(db.get_connection())
+
+    return {
+        'lawyer': lawyer_bot.build_application(),
+        'client': client_bot.build_application(),
+    }
+
+async def run_polling(applications, stop_event=None):
+    """Получает обновления обоих ботов через getUpdates до SIGINT/SIGTERM или stop_event"""
+    if stop_event is None:
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop_event.set)
+
+    await start_applications(applications)
+    try:
+        for application in applications.values():
+            await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+        logging.info(f"Боты запущены в одном процессе: {', '.join(applications)}")
+
+        await stop_event.wait()
+        logging.info("Остановка ботов")
+    finally:
+        # Сначала перестаем получать обновления, затем дорабатываем полученные
+        for application in applications.values():
+            if application.updater.running:
+                await application.updater.stop()
+        await stop_applications(applications)
+
+def main():
+    applications = build_applications()
+    print("Боты запущены в одном процессе...")
+    try:
+        asyncio.run(run_polling(applications))
+    finally:
+        resources.close()
+
+if __name__ == "__main__":
+    main()
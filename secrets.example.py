@@ -15,3 +15,72 @@ LAWYERS = {
         "full_name": "ФИО Адвоката"
     }
 }
+
+# Необязательные настройки (если не заданы, используются значения по умолчанию)
+
+# Наложение штампов: 'process' (пул процессов) или 'thread' (пул потоков)
+STAMP_EXECUTOR = "process"
+STAMP_WORKERS = 2
+STAMP_MAX_PENDING = 8   # максимум штампов в пуле, остальные ждут очереди
+STAMP_TIMEOUT = 60      # секунд на один штамп
+STAMP_INCREMENTAL = True  # дописывать штамп инкрементальным обновлением, не меняя исходные байты
+
+# База данных: потоков для параллельных чтений (записи идут в одном потоке)
+DB_READERS = 4
+
+# Очередь писем с кодами
+MAIL_WORKERS = 2        # параллельных отправок
+MAIL_MAX_ATTEMPTS = 5   # попыток до уведомления пользователя об ошибке
+MAIL_RETRY_BASE = 5     # секунд до первой повторной попытки, далее пауза удваивается
+MAIL_RETRY_MAX = 120    # предельная пауза между попытками
+
+# Пул SMTP-сессий
+SMTP_POOL_SIZE = 2       # одновременно открытых сессий
+SMTP_IDLE_TIMEOUT = 60   # закрывать сессию после простоя, секунд
+SMTP_CHECK_AFTER = 5     # проверять сессию командой NOOP, если она простаивала дольше, секунд
+SMTP_TIMEOUT = 30        # таймаут сетевых операций, секунд
+
+# Ограничение скорости отправки писем (писем в секунду и запас на всплеск);
+# лимиты действуют в каждом процессе: при двух службах lawyer-bot и client-bot суммарно вдвое больше
+SMTP_RATE = 5
+SMTP_BURST = 10
+SMTP_DOMAIN_RATE = 1     # на каждый домен получателя
+SMTP_DOMAIN_BURST = 5
+SMTP_DOMAIN_LIMITS = {}  # отдельные лимиты провайдеров, например {'gmail.com': (2, 10)}
+MAIL_BATCH_SIZE = 5      # писем на один домен за одну SMTP-сессию
+MAIL_BATCH_WINDOW = 0    # секунд ждать попутных писем на тот же домен
+SMTP_STARTTLS = True     # False только для локального smtp_sink.py
+
+# Прогрев: модули PDF и почты загружаются в фоне через WARMUP_DELAY секунд после запуска
+WARMUP = True
+WARMUP_DELAY = 5
+
+# Коды подписи: срок действия и задержка записи счетчиков неверных попыток, секунд
+CODE_TTL = 600
+CODE_FLUSH_DELAY = 5
+
+# Обслуживание базы (JobQueue бота адвоката), секунд
+MAINTENANCE_INTERVAL = 6 * 60 * 60
+CODE_RETENTION = 7 * 24 * 60 * 60     # хранить истекшие коды подписи
+MAIL_RETENTION = 7 * 24 * 60 * 60     # хранить отправленные письма
+BLOB_RETENTION = 24 * 60 * 60         # хранить файлы прежних версий документов
+CHANGE_LOG_RETENTION = 24 * 60 * 60   # хранить журнал изменений для сброса кешей
+
+# Кеш клиентов и документов для подписи в боте клиента: записей и секунд жизни записи
+CLIENT_CACHE_SIZE = 1024
+CLIENT_CACHE_TTL = 300
+
+# Сохранение user_data и состояний диалогов в documents.db: раз в столько секунд
+PERSISTENCE_INTERVAL = 60
+
+# Параллельная обработка обновлений: обновления одного пользователя идут по очереди
+UPDATE_CONCURRENCY = 32
+
+# Прокси для запросов к Bot API и скачивания файлов, например "http://proxy.local:3128"
+TELEGRAM_PROXY = None
+
+# Режим webhook (python3 webhook.py): оба бота на одном локальном HTTP-сервере
+WEBHOOK_URL = None          # внешний адрес за обратным прокси, например "https://bots.example.com/tg"
+WEBHOOK_LISTEN = "127.0.0.1"
+WEBHOOK_PORT = 8443
+WEBHOOK_SECRET = None       # 1-256 символов A-Z, a-z, 0-9, _ и -
@@ -25,3 +25,4 @@ echo "Не забудьте:"
 echo "1. Настроить secrets.py с вашими данными"
 echo "2. Запустить ботов: systemctl start lawyer-bot client-bot"
 echo "3. Включить автозапуск: systemctl enable lawyer-bot client-bot"
+echo "   (или оба бота одним процессом: systemctl enable --now bots)"
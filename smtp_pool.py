@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+import logging
+import smtplib
+import threading
+import time
+
+import secrets as _secrets
+from secrets import EMAIL_HOST, EMAIL_PORT, EMAIL_USER, EMAIL_PASSWORD
+
+# Необязательные настройки из secrets.py
+SMTP_POOL_SIZE = getattr(_secrets, 'SMTP_POOL_SIZE', 2)
+SMTP_IDLE_TIMEOUT = getattr(_secrets, 'SMTP_IDLE_TIMEOUT', 60)   # закрывать сессию после простоя, с
+SMTP_CHECK_AFTER = getattr(_secrets, 'SMTP_CHECK_AFTER', 5)      # проверять NOOP после простоя, с
+SMTP_TIMEOUT = getattr(_secrets, 'SMTP_TIMEOUT', 30)             # таймаут сокета, с
+SMTP_STARTTLS = getattr(_secrets, 'SMTP_STARTTLS', True)         # False только для локального smtp_sink.py
+
+# Ошибки, после которых сессию нужно открыть заново
+RECONNECT_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError, TimeoutError)
+
+class SMTPPool:
+    """Пул авторизованных SMTP-сессий
+
+    Подключение, STARTTLS и AUTH выполняются один раз на сессию, а не на
+    каждое письмо. Перед использованием после простоя сессия проверяется
+    командой NOOP; разорванная сессия переоткрывается незаметно для
+    вызывающего. Сессии без работы дольше idle_timeout закрываются.
+    Методы блокирующие и вызываются из потоков (asyncio.to_thread).
+    """
+
+    def __init__(self, host=EMAIL_HOST, port=EMAIL_PORT, user=EMAIL_USER, password=EMAIL_PASSWORD,
+                 size=SMTP_POOL_SIZE, idle_timeout=SMTP_IDLE_TIMEOUT,
+                 check_after=SMTP_CHECK_AFTER, timeout=SMTP_TIMEOUT, starttls=SMTP_STARTTLS):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.check_after = check_after
+        self.timeout = timeout
+        self.starttls = starttls
+        self._idle = []          # [(server, время последнего использования)]
+        self._open = 0           # открытых сессий, включая выданные
+        self._condition = threading.Condition()
+        self._reaper = None
+        self._closed = threading.Event()
+
+    def _connect(self):
+        """Открывает и авторизует новую сессию"""
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                server.starttls()
+            server.login(self.user, self.password)
+        except Exception:
+            self._quit(server)
+            raise
+        logging.info(f"Открыта SMTP-сессия {self.host}:{self.port}")
+        return server
+
+    @staticmethod
+    def _quit(server):
+        """Закрывает сессию, не обращая внимания на ошибки"""
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+    @staticmethod
+    def _is_alive(server):
+        """Проверяет сессию командой NOOP"""
+        try:
+            return server.noop()[0] == 250
+        except Exception:
+            return False
+
+    def _acquire(self):
+        """Выдает рабочую сессию, при необходимости открывая новую"""
+        with self._condition:
+            while not self._idle and self._open >= self.size and not self._closed.is_set():
+                self._condition.wait()
+            if self._closed.is_set():
+                raise RuntimeError("SMTP-пул закрыт")
+            if self._idle:
+                server, last_used = self._idle.pop()
+            else:
+                server, last_used = None, None
+                self._open += 1
+            self._start_reaper()
+
+        try:
+            if server is not None and time.monotonic() - last_used > self.check_after:
+                if not self._is_alive(server):
+                    logging.info("SMTP-сессия разорвана сервером, переподключение")
+                    self._quit(server)
+                    server = None
+            if server is None:
+                server = self._connect()
+        except Exception:
+            self._discard()
+            raise
+        return server
+
+    def _release(self, server):
+        """Возвращает сессию в пул"""
+        with self._condition:
+            if not self._closed.is_set():
+                self._idle.append((server, time.monotonic()))
+                self._condition.notify()
+                return
+            self._open -= 1
+        self._quit(server)
+
+    def _discard(self, server=None):
+        """Убирает неисправную сессию из пула"""
+        if server is not None:
+            self._quit(server)
+        with self._condition:
+            self._open -= 1
+            self._condition.notify()
+
+    def _send(self, server, from_addr, to_addrs, data):
+        """Отправляет письмо через server или новую сессию
+
+        Если сессия оказалась разорвана, письмо отправляется повторно
+        через новую сессию. Возвращает (сессия, ошибка): сессия равна None,
+        если ее нельзя использовать дальше, ошибка - None при успехе.
+        """
+        for attempt in range(2):
+            try:
+                if server is None:
+                    server = self._acquire()
+                server.sendmail(from_addr, to_addrs, data)
+                return server, None
+            except RECONNECT_ERRORS as e:
+                if server is not None:
+                    self._discard(server)
+                    server = None
+                if attempt:
+                    return None, e
+                logging.info(f"SMTP-сессия разорвана при отправке ({e}), переподключение")
+            except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused) as e:
+                # Сервер отклонил письмо, но сессия исправна
+                return server, e
+            except Exception as e:
+                if server is not None:
+                    self._discard(server)
+                return None, e
+
+    def sendmail(self, from_addr, to_addrs, data):
+        """Отправляет готовое письмо (байты) через сессию из пула"""
+        server, error = self._send(None, from_addr, to_addrs, data)
+        if server is not None:
+            self._release(server)
+        if error is not None:
+            raise error
+
+    def send_batch(self, from_addr, messages):
+        """Отправляет несколько писем [(to_addrs, data)] через одну сессию
+
+        Возвращает список ошибок по письмам (None для отправленных).
+        """
+        errors = []
+        server = None
+        for to_addrs, data in messages:
+            server, error = self._send(server, from_addr, to_addrs, data)
+            errors.append(error)
+        if server is not None:
+            self._release(server)
+        return errors
+
+    def close_idle(self):
+        """Закрывает сессии, простаивающие дольше idle_timeout"""
+        now = time.monotonic()
+        with self._condition:
+            expired = [server for server, last_used in self._idle if now - last_used > self.idle_timeout]
+            self._idle = [(server, last_used) for server, last_used in self._idle
+                          if now - last_used <= self.idle_timeout]
+            self._open -= len(expired)
+            self._condition.notify_all()
+        for server in expired:
+            self._quit(server)
+        return len(expired)
+
+    def _start_reaper(self):
+        """Запускает фоновый поток закрытия простаивающих сессий"""
+        if self._reaper is None:
+            self._reaper = threading.Thread(target=self._reap, name='smtp-reaper', daemon=True)
+            self._reaper.start()
+
+    def _reap(self):
+        while not self._closed.wait(self.idle_timeout / 2):
+            closed = self.close_idle()
+            if closed:
+                logging.info(f"Закрыто простаивающих SMTP-сессий: {closed}")
+
+    def close(self):
+        """Закрывает все сессии пула"""
+        with self._condition:
+            self._closed.set()
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+            self._condition.notify_all()
+        for server, _ in idle:
+            self._quit(server)
+
+smtp_pool = SMTPPool()
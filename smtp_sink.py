@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""Локальный SMTP-сервер для проверки и бенчмарков отправки писем
+
+Принимает письма от любого отправителя, сохраняет их в памяти и никуда
+не пересылает. Может добавлять задержку ответа и отвечать ошибками,
+имитируя медленного или перегруженного провайдера. STARTTLS не
+поддерживается: в secrets.py для работы с ним нужно SMTP_STARTTLS = False.
+
+Запуск: python3 smtp_sink.py --port 8025 --latency 0.2 --fail-rate 0.1
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import threading
+import time
+
+class SMTPSink:
+    """SMTP-сервер на asyncio, сохраняющий принятые письма в messages
+
+    latency - задержка ответа на DATA и на подключение в секундах,
+    fail_rate - доля писем, отклоняемых временной ошибкой 451,
+    drop_rate - доля писем, после которых соединение разрывается.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, fail_rate=0.0, drop_rate=0.0,
+                 on_message=None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.drop_rate = drop_rate
+        self.on_message = on_message
+        self.messages = []     # [(время приема, отправитель, получатели, данные)]
+        self.connections = 0
+        self.rejected = 0
+        self._server = None
+        self._loop = None
+        self._thread = None
+
+    async def start(self):
+        """Начинает принимать соединения; port=0 выбирает свободный порт"""
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logging.info(f"SMTP-заглушка слушает {self.host}:{self.port}")
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    def start_in_thread(self):
+        """Запускает сервер в отдельном потоке со своим event loop
+
+        Нужно, когда клиент отправляет письма блокирующими вызовами
+        из того же потока, что и event loop.
+        """
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.start())
+            started.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(self.stop())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name='smtp-sink', daemon=True)
+        self._thread.start()
+        started.wait()
+
+    def stop_thread(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    async def _handle(self, reader, writer):
+        """Диалог с одним клиентом"""
+        self.connections += 1
+
+        async def reply(line):
+            writer.write(line.encode() + b'\r\n')
+            await writer.drain()
+
+        try:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            await reply("220 smtp-sink ESMTP")
+            sender, recipients = None, []
+
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                command, _, argument = line.decode('utf-8', 'replace').strip().partition(' ')
+                command = command.upper()
+
+                if command == 'EHLO':
+                    await reply("250-smtp-sink\r\n250-AUTH PLAIN LOGIN\r\n250-8BITMIME\r\n250 OK")
+                elif command == 'HELO':
+                    await reply("250 smtp-sink")
+                elif command == 'AUTH':
+                    mechanism, _, initial = argument.partition(' ')
+                    if mechanism.upper() == 'LOGIN':
+                        # Логин и пароль не проверяются
+                        if not initial:
+                            await reply("334 VXNlcm5hbWU6")
+                            await reader.readline()
+                        await reply("334 UGFzc3dvcmQ6")
+                        await reader.readline()
+                    elif not initial:
+                        await reply("334 ")
+                        await reader.readline()
+                    await reply("235 Authentication successful")
+                elif command == 'MAIL':
+                    sender, recipients = argument, []
+                    await reply("250 OK")
+                elif command == 'RCPT':
+                    recipients.append(argument.partition(':')[2].strip().strip('<>'))
+                    await reply("250 OK")
+                elif command == 'DATA':
+                    await reply("354 End data with <CR><LF>.<CR><LF>")
+                    chunks = []
+                    while True:
+                        chunk = await reader.readline()
+                        if not chunk or chunk == b'.\r\n':
+                            break
+                        chunks.append(chunk[1:] if chunk.startswith(b'..') else chunk)
+                    if self.latency:
+                        await asyncio.sleep(self.latency)
+
+                    if random.random() < self.drop_rate:
+                        self.rejected += 1
+                        return
+                    if random.random() < self.fail_rate:
+                        self.rejected += 1
+                        await reply("451 Temporary failure, try again later")
+                    else:
+                        message = (time.monotonic(), sender, recipients, b''.join(chunks))
+                        self.messages.append(message)
+                        if self.on_message is not None:
+                            self.on_message(*message)
+                        await reply("250 OK: queued")
+                    sender, recipients = None, []
+                elif command == 'RSET':
+                    sender, recipients = None, []
+                    await reply("250 OK")
+                elif command == 'NOOP':
+                    await reply("250 OK")
+                elif command == 'QUIT':
+                    await reply("221 Bye")
+                    return
+                else:
+                    await reply("502 Command not implemented")
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальный SMTP-сервер, сохраняющий письма в памяти")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8025)
+    parser.add_argument('--latency', type=float, default=0.0, help="задержка ответа, секунд")
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="доля писем с ошибкой 451")
+    parser.add_argument('--drop-rate', type=float, default=0.0, help="доля писем с разрывом соединения")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    def log_message(received_at, sender, recipients, data):
+        logging.info(f"Письмо от {sender} для {', '.join(recipients)}, {len(data)} байт")
+
+    async def serve():
+        sink = SMTPSink(args.host, args.port, args.latency, args.fail_rate, args.drop_rate, log_message)
+        await sink.start()
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+import asyncio
+import importlib
+import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import secrets as _secrets
+
+# Необязательные настройки из secrets.py
+STAMP_EXECUTOR = getattr(_secrets, 'STAMP_EXECUTOR', 'process')  # 'process' или 'thread'
+STAMP_WORKERS = getattr(_secrets, 'STAMP_WORKERS', 2)
+STAMP_MAX_PENDING = getattr(_secrets, 'STAMP_MAX_PENDING', 8)
+STAMP_TIMEOUT = getattr(_secrets, 'STAMP_TIMEOUT', 60)
+STAMP_INCREMENTAL = getattr(_secrets, 'STAMP_INCREMENTAL', True)
+
+class StampService:
+    """Выполняет наложение штампов вне event loop в пуле процессов или потоков
+
+    pdf_stamp (reportlab и PyPDF2) загружается при первом штампе
+    или при прогреве, а не при запуске бота.
+    """
+
+    def __init__(self, executor=STAMP_EXECUTOR, workers=STAMP_WORKERS,
+                 max_pending=STAMP_MAX_PENDING, timeout=STAMP_TIMEOUT,
+                 incremental=STAMP_INCREMENTAL):
+        self.executor_type = executor
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.incremental = incremental
+        self._executor = None
+        self._pending = 0
+        self._slots = None
+
+    def _get_executor(self):
+        """Создает пул при первом использовании"""
+        if self._executor is None:
+            if self.executor_type == 'thread':
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='stamp')
+            else:
+                self._executor = ProcessPoolExecutor(self.workers)
+        return self._executor
+
+    async def run(self, func, *args):
+        """Выполняет функцию в пуле с ограничением очереди и таймаутом
+
+        Если в пуле уже max_pending задач, вызов ждет, пока одна из них
+        завершится. Место освобождается, когда задача действительно
+        завершилась в пуле, а не когда истек таймаут: задачу, уже начатую
+        в пуле, прервать нельзя. Она дописывает свой выходной файл и
+        продолжает занимать исполнителя; результат никто не использует,
+        а недописанный временный файл удалит сборщик мусора хранилища.
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        if self._slots.locked():
+            logging.warning(f"Очередь штампов заполнена ({self.max_pending}), ожидание")
+        await self._slots.acquire()
+
+        try:
+            future = self._get_executor().submit(func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        self._pending += 1
+        result = asyncio.wrap_future(future)
+        result.add_done_callback(self._finished)
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(result), self.timeout)
+        except asyncio.TimeoutError:
+            if not future.cancel():
+                logging.warning(f"Штамп продолжает выполняться в пуле после таймаута "
+                                f"({self.timeout} с), в очереди {self._pending} из {self.max_pending}")
+            raise
+
+    def _finished(self, result):
+        """Освобождает место в очереди, когда задача завершилась в пуле"""
+        self._pending -= 1
+        self._slots.release()
+
+    async def add_signature_to_pdf(self, original_pdf, signature_data, output_pdf):
+        """Асинхронная версия pdf_stamp.add_signature_to_pdf
+
+        Возвращает SHA-256 нового файла или False при ошибке.
+        """
+        try:
+            pdf_stamp = await asyncio.to_thread(importlib.import_module, 'pdf_stamp')
+            return await self.run(pdf_stamp.add_signature_to_pdf, original_pdf, signature_data,
+                                  output_pdf, self.incremental)
+        except asyncio.TimeoutError:
+            logging.error(f"Превышено время наложения штампа ({self.timeout} с): {original_pdf}")
+        except Exception as e:
+            logging.error(f"Ошибка сервиса штампов: {e}")
+        return False
+
+    def shutdown(self):
+        """Останавливает пул"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+stamp_service = StampService()
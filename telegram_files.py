@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+import asyncio
+import logging
+
+import httpx
+from telegram.error import BadRequest
+
+import secrets as _secrets
+
+import db
+from document_store import HashingWriter
+
+# Необязательная настройка из secrets.py: прокси для Bot API и скачивания файлов
+TELEGRAM_PROXY = getattr(_secrets, 'TELEGRAM_PROXY', None)
+
+# Размер части при скачивании файлов из Telegram
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+DOWNLOAD_TIMEOUT = 60
+
+_http_clients = {}   # настройки запросов бота -> HTTP-клиент для скачивания
+
+def _client(bot):
+    """HTTP-клиент для скачивания файлов с настройками запросов бота
+
+    Прокси, пул соединений и таймауты берутся из HTTPXRequest бота, чтобы
+    скачивание шло тем же путем, что и запросы к Bot API; увеличивается
+    только таймаут чтения. Транспорт бота не переиспользуется: клиент
+    закрыл бы его вместе с собой.
+    """
+    request = bot.request
+    client = _http_clients.get(request)
+    if client is None:
+        # _client_kwargs - параметры, из которых HTTPXRequest строит свой клиент
+        kwargs = dict(getattr(request, '_client_kwargs', {}))
+        kwargs.pop('transport', None)
+        timeout = kwargs.get('timeout') or httpx.Timeout(DOWNLOAD_TIMEOUT)
+        kwargs['timeout'] = httpx.Timeout(connect=timeout.connect, read=DOWNLOAD_TIMEOUT,
+                                          write=timeout.write, pool=timeout.pool)
+        client = _http_clients[request] = httpx.AsyncClient(**kwargs)
+    return client
+
+async def download_to_path(file, path):
+    """Скачивает telegram.File частями прямо в файл path и возвращает его SHA-256
+
+    Файл не собирается целиком в памяти: каждая часть записывается на диск
+    в отдельном потоке, пока по сети принимается следующая.
+    """
+    with open(path, 'wb') as output_file:
+        writer = HashingWriter(output_file)
+
+        if not file.file_path.startswith(('http://', 'https://')):
+            # Локальный Bot API сервер отдает путь к файлу на диске
+            await file.download_to_memory(writer)
+            return writer.hexdigest()
+
+        pending = None
+        async with _client(file.get_bot()).stream('GET', file.file_path) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                if pending is not None:
+                    await pending
+                pending = asyncio.ensure_future(asyncio.to_thread(writer.write, chunk))
+        if pending is not None:
+            await pending
+
+    return writer.hexdigest()
+
+async def close():
+    """Закрывает HTTP-клиенты для скачивания"""
+    clients = list(_http_clients.values())
+    _http_clients.clear()
+    for client in clients:
+        await client.aclose()
+
+async def send_document(bot, bot_name, chat_id, document_id, file_path, content_hash, **kwargs):
+    """Отправляет версию документа, загружая файл в Telegram только один раз
+
+    file_id первой загрузки сохраняется для пары (документ, SHA-256 версии);
+    повторные отправки ссылаются на него. Новая версия после штампа имеет
+    другой хеш, поэтому будет загружена заново.
+    """
+    if content_hash:
+        file_id = await db.read_async(db.get_telegram_file_id, bot_name, document_id, content_hash)
+        if file_id:
+            try:
+                return await bot.send_document(chat_id=chat_id, document=file_id, **kwargs)
+            except BadRequest as e:
+                logging.warning(f"Telegram не принял сохраненный file_id документа {document_id}: {e}")
+                await db.write_async(db.delete_telegram_file_id, bot_name, document_id, content_hash)
+
+    with open(file_path, 'rb') as doc_file:
+        message = await bot.send_document(chat_id=chat_id, document=doc_file, **kwargs)
+
+    if content_hash:
+        await db.write_async(db.save_telegram_file_id, bot_name, document_id, content_hash,
+                             message.document.file_id)
+    return message
@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+# Модули ботов лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+
+@pytest.fixture
+def temp_db(tmp_path, monkeypatch):
+    """Временная база со всеми миграциями вместо рабочей"""
+    monkeypatch.setattr(db, 'DB_PATH', str(tmp_path / 'documents.db'))
+    db.init_database()
+    yield db.DB_PATH
+    db.shutdown()
+    db.close_connection()
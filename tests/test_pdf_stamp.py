@@ -0,0 +1,111 @@
+import io
+
+from PyPDF2 import PdfReader
+from PyPDF2.generic import ArrayObject, DecodedStreamObject, NameObject, NumberObject
+from reportlab.pdfgen import canvas
+
+import pdf_stamp
+
+SIGNATURE = {
+    'document_hash': '3f2a9c1e5b7d4f6a8c0e2b4d6f8a0c2e',
+    'lawyer_signed': True,
+    'lawyer_name': 'Иванов Иван Иванович',
+    'lawyer_sign_date': '01.10.2026 12:00:00',
+    'client_signed': False,
+    'client_name': 'Петров Петр Петрович',
+}
+
+def make_pdf(pages):
+    """PDF с классической таблицей xref, как его пишет reportlab"""
+    output = io.BytesIO()
+    pdf = canvas.Canvas(output)
+    for number in range(1, pages + 1):
+        pdf.drawString(100, 700, f"Page {number}")
+        pdf.showPage()
+    pdf.save()
+    return output.getvalue()
+
+def to_xref_stream_pdf(data):
+    """Те же объекты, но перекрестные ссылки в потоке /Type /XRef (PDF 1.5+)"""
+    reader = PdfReader(io.BytesIO(data))
+    size = int(reader.trailer['/Size'])
+    output = io.BytesIO()
+    output.write(b"%PDF-1.5\n%\xe2\xe3\xcf\xd3\n")
+
+    offsets = {}
+    for idnum in range(1, size):
+        offsets[idnum] = output.tell()
+        output.write(f"{idnum} 0 obj\n".encode())
+        reader.get_object(idnum).write_to_stream(output, None)
+        output.write(b"\nendobj\n")
+
+    xref_offset = offsets[size] = output.tell()
+    entries = [b'\x00' + (0).to_bytes(4, 'big') + (65535).to_bytes(2, 'big')]
+    entries += [b'\x01' + offsets[idnum].to_bytes(4, 'big') + (0).to_bytes(2, 'big')
+                for idnum in range(1, size + 1)]
+    stream = DecodedStreamObject()
+    stream.set_data(b''.join(entries))
+    stream = stream.flate_encode()
+    stream.update({
+        NameObject('/Type'): NameObject('/XRef'),
+        NameObject('/Size'): NumberObject(size + 1),
+        NameObject('/W'): ArrayObject([NumberObject(1), NumberObject(4), NumberObject(2)]),
+        NameObject('/Root'): reader.trailer.raw_get('/Root'),
+        NameObject('/Info'): reader.trailer.raw_get('/Info'),
+        NameObject('/ID'): reader.trailer['/ID'],
+    })
+    output.write(f"{size} 0 obj\n".encode())
+    stream.write_to_stream(output, None)
+    output.write(f"\nendobj\nstartxref\n{xref_offset}\n%%EOF\n".encode())
+    return output.getvalue()
+
+def stamp_incrementally(original):
+    stamped = pdf_stamp.stamp_pdf_bytes(original, SIGNATURE, incremental=True)
+    assert stamped.startswith(original)
+    return stamped, stamped[len(original):]
+
+def id_bytes(reader):
+    """Части /ID трейлера в виде байтов; PyPDF2 читает часть строк как текст"""
+    return [bytes(part) if isinstance(part, bytes) else part.get_original_bytes()
+            for part in reader.trailer['/ID']]
+
+def check_stamped(original, stamped):
+    before = PdfReader(io.BytesIO(original), strict=True)
+    after = PdfReader(io.BytesIO(stamped), strict=True)
+    assert len(after.pages) == len(before.pages)
+    last_page = after.pages[len(after.pages) - 1]
+    assert pdf_stamp.STAMP_XOBJECT_NAME in last_page['/Resources']['/XObject']
+    assert f"Page {len(before.pages)}" in last_page.extract_text()
+
+    # Первая часть /ID сохраняется байт в байт, вторая меняется с новой ревизией
+    before_id, after_id = id_bytes(before), id_bytes(after)
+    assert after_id[0] == before_id[0]
+    assert after_id[1] != before_id[1]
+
+def test_incremental_update_of_xref_table_pdf_uses_xref_table():
+    original = make_pdf(3)
+    stamped, update = stamp_incrementally(original)
+
+    assert b"\nxref\n" in update and b"trailer" in update
+    assert b"/XRef" not in update
+    check_stamped(original, stamped)
+
+def test_incremental_update_of_xref_stream_pdf_uses_xref_stream():
+    original = to_xref_stream_pdf(make_pdf(3))
+    assert b"\nxref\n" not in original
+
+    stamped, update = stamp_incrementally(original)
+
+    # Без таблицы xref и классического трейлера: гибридный файл строгие читатели могут отвергнуть
+    assert b"\nxref\n" not in update and b"trailer" not in update
+    assert b"/Type /XRef" in update
+    check_stamped(original, stamped)
+
+def test_repeated_incremental_stamp_replaces_previous_stamp():
+    original = to_xref_stream_pdf(make_pdf(2))
+    once, _ = stamp_incrementally(original)
+    twice, _ = stamp_incrementally(once)
+
+    check_stamped(once, twice)
+    last_page = PdfReader(io.BytesIO(twice)).pages[1]
+    assert len(last_page['/Contents']) == len(PdfReader(io.BytesIO(once)).pages[1]['/Contents'])
@@ -0,0 +1,7 @@
+import db
+
+def test_hot_queries_use_indexes(temp_db):
+    """Ни один частый запрос не читает всю таблицу"""
+    plans = db.explain_hot_queries(db.get_connection().cursor())
+    full_scans = {name: detail for name, plan in plans.items() for detail in plan if db.is_full_scan(detail)}
+    assert not full_scans
@@ -0,0 +1,153 @@
+import asyncio
+import json
+import pathlib
+
+import httpx
+import pytest
+from telegram import Update
+from telegram.ext import Application, TypeHandler
+
+import webhook
+
+SECRET = 'test-secret'
+UPDATES_DIR = pathlib.Path(__file__).parent / 'fixtures' / 'updates'
+UPDATE_FILES = sorted(path.name for path in UPDATES_DIR.glob('*.json'))
+
+def load_update(name):
+    """Записанное обновление Telegram в том виде, в каком его присылает Bot API"""
+    return json.loads((UPDATES_DIR / name).read_text())
+
+async def fake_bot_api(method, path, headers, body):
+    """Заглушка Bot API: приложению при запуске нужен только getMe"""
+    if path.endswith('/getMe'):
+        result = {'id': 6153307842, 'is_bot': True, 'first_name': 'Подпись документов',
+                  'username': 'sign_client_bot'}
+    else:
+        result = True
+    return 200, json.dumps({'ok': True, 'result': result}).encode(), 'application/json'
+
+class Bots:
+    """Бот 'client' за WebhookServer, записывающий полученные обновления"""
+
+    def __init__(self):
+        self.received = []
+        self.api = webhook.HTTPServer(fake_bot_api)
+        self.application = None
+        self.server = None
+        self.stopped = False
+
+    async def _record(self, update, context):
+        self.received.append(update.update_id)
+
+    async def start(self):
+        await self.api.start()
+        self.application = (Application.builder().token('1:test')
+                            .base_url(f"http://127.0.0.1:{self.api.port}/bot")
+                            .updater(None)
+                            .build())
+        self.application.add_handler(TypeHandler(Update, self._record))
+        self.server = webhook.WebhookServer({'client': self.application}, SECRET, '127.0.0.1', 0)
+        await webhook.start_applications({'client': self.application})
+        await self.server.start()
+
+    async def stop(self):
+        if self.stopped:
+            return
+        self.stopped = True
+        await self.server.stop()
+        await webhook.stop_applications({'client': self.application})
+        await self.api.stop()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.http.port}"
+
+def run_with_bots(scenario):
+    """Запускает сценарий scenario(bots, client) с запущенным ботом и останавливает его"""
+    async def main():
+        bots = Bots()
+        await bots.start()
+        try:
+            async with httpx.AsyncClient(base_url=bots.url) as client:
+                return await scenario(bots, client)
+        finally:
+            await bots.stop()
+    return asyncio.run(main())
+
+@pytest.mark.parametrize('name', UPDATE_FILES)
+def test_valid_update_is_accepted_and_handled(name):
+    update = load_update(name)
+
+    async def scenario(bots, client):
+        response = await client.post('/client', json=update, headers={webhook.SECRET_HEADER: SECRET})
+        await bots.stop()
+        return response.status_code, bots.received
+
+    status, received = run_with_bots(scenario)
+    assert status == 200
+    assert received == [update['update_id']]
+
+@pytest.mark.parametrize('headers', [{webhook.SECRET_HEADER: 'wrong'}, {}], ids=['wrong', 'missing'])
+def test_update_without_valid_secret_is_rejected(headers):
+    async def scenario(bots, client):
+        response = await client.post('/client', json=load_update('start.json'), headers=headers)
+        await bots.stop()
+        return response.status_code, bots.received
+
+    status, received = run_with_bots(scenario)
+    assert status == 403
+    assert received == []
+
+def test_unknown_path_and_wrong_method():
+    async def scenario(bots, client):
+        headers = {webhook.SECRET_HEADER: SECRET}
+        unknown = await client.post('/lawyer', json=load_update('start.json'), headers=headers)
+        wrong_method = await client.get('/client', headers=headers)
+        return unknown.status_code, wrong_method.status_code
+
+    assert run_with_bots(scenario) == (404, 405)
+
+def test_oversized_body_is_rejected():
+    async def scenario(bots, client):
+        # Тело не отправляется: сервер отвечает по Content-Length, не читая его
+        reader, writer = await asyncio.open_connection('127.0.0.1', bots.server.http.port)
+        writer.write(
+            f"POST /client HTTP/1.1\r\nHost: 127.0.0.1\r\n"
+            f"{webhook.SECRET_HEADER}: {SECRET}\r\n"
+            f"Content-Length: {webhook.MAX_BODY_SIZE + 1}\r\n\r\n".encode('latin-1')
+        )
+        await writer.drain()
+        status_line = await reader.readline()
+        writer.close()
+        return status_line
+
+    assert run_with_bots(scenario).startswith(b'HTTP/1.1 413')
+
+def test_stop_drains_in_flight_updates():
+    update = load_update('email.json')
+
+    async def scenario(bots, client):
+        entered, release = asyncio.Event(), asyncio.Event()
+        handle = bots.server.http.handle
+
+        async def slow_handle(*args):
+            entered.set()
+            await release.wait()
+            return await handle(*args)
+
+        bots.server.http.handle = slow_handle
+        post = asyncio.create_task(
+            client.post('/client', json=update, headers={webhook.SECRET_HEADER: SECRET}))
+        await entered.wait()
+
+        # Остановка начинается, пока обновление еще принимается
+        stopping = asyncio.create_task(bots.stop())
+        await asyncio.sleep(0.05)
+        assert not stopping.done()
+        release.set()
+        await stopping
+        return (await post).status_code, bots.received
+
+    status, received = run_with_bots(scenario)
+    assert status == 200
+    assert received == [update['update_id']]
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+import asyncio
+import sys
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+import secrets as _secrets
+
+# Необязательная настройка из secrets.py: сколько обновлений обрабатывать одновременно
+UPDATE_CONCURRENCY = getattr(_secrets, 'UPDATE_CONCURRENCY', 32)
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка обновлений разных пользователей
+
+    Обновления одного пользователя (или чата, если пользователя нет)
+    обрабатываются строго по очереди: context.user_data и состояние
+    ConversationHandler меняются так же, как при последовательной обработке.
+    Пока один пользователь ждет штамп или отправку письма, обновления
+    остальных обрабатываются.
+
+    Ограничение max_concurrent_updates действует только на обновления,
+    которые уже выполняются: семафор берется после блокировки пользователя.
+    Обновления, ждущие своей очереди у одного пользователя, не занимают
+    места остальных.
+    """
+
+    __slots__ = ('_locks', '_running')
+
+    def __init__(self, max_concurrent_updates=UPDATE_CONCURRENCY):
+        # Семафор BaseUpdateProcessor берется до do_process_update, то есть и для
+        # обновлений, ждущих блокировки пользователя; поэтому он не ограничивает
+        if max_concurrent_updates < 1:
+            raise ValueError("max_concurrent_updates должно быть положительным")
+        super().__init__(sys.maxsize)
+        self._max_concurrent_updates = max_concurrent_updates
+        self._locks = {}    # ключ -> [asyncio.Lock, число обновлений, ожидающих или держащих блокировку]
+        self._running = asyncio.BoundedSemaphore(max_concurrent_updates)
+
+    @staticmethod
+    def _key(update):
+        """Ключ очереди: id пользователя, иначе id чата"""
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user is not None:
+            return ('user', update.effective_user.id)
+        if update.effective_chat is not None:
+            return ('chat', update.effective_chat.id)
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        key = self._key(update)
+        if key is None:
+            async with self._running:
+                await coroutine
+            return
+
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0], self._running:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
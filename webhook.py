@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""Оба бота в режиме webhook на одном локальном HTTP-сервере
+
+Вместо двух процессов с run_polling() Telegram сам присылает обновления
+на WEBHOOK_URL/lawyer и WEBHOOK_URL/client. Сервер слушает локальный адрес
+(WEBHOOK_LISTEN:WEBHOOK_PORT), снаружи его закрывает обратный прокси с TLS.
+Каждый запрос проверяется по заголовку X-Telegram-Bot-Api-Secret-Token.
+
+Запуск: python3 webhook.py
+"""
+
+import asyncio
+import hmac
+import json
+import logging
+import signal
+
+from telegram import Update
+
+import secrets as _secrets
+
+# Необязательные настройки из secrets.py
+WEBHOOK_URL = getattr(_secrets, 'WEBHOOK_URL', None)   # внешний адрес, например https://bots.example.com/tg
+WEBHOOK_LISTEN = getattr(_secrets, 'WEBHOOK_LISTEN', '127.0.0.1')
+WEBHOOK_PORT = getattr(_secrets, 'WEBHOOK_PORT', 8443)
+WEBHOOK_SECRET = getattr(_secrets, 'WEBHOOK_SECRET', None)
+
+SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+MAX_BODY_SIZE = 1024 * 1024
+
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+               405: 'Method Not Allowed', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+class HTTPServer:
+    """Минимальный HTTP/1.1 сервер на asyncio
+
+    handle(method, path, headers, body) возвращает (статус, тело, content-type).
+    Соединения поддерживаются открытыми (keep-alive), как их использует Telegram.
+    """
+
+    def __init__(self, handle, host='127.0.0.1', port=0):
+        self.handle = handle
+        self.host = host
+        self.port = port
+        self._server = None
+        self._connections = {}    # задача соединения -> writer
+        self._active = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def start(self):
+        """Начинает принимать соединения; port=0 выбирает свободный порт"""
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """Перестает принимать соединения, дожидается начатых запросов и закрывает соединения"""
+        self._server.close()
+        await self._idle.wait()
+        for writer in self._connections.values():
+            writer.close()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        await self._server.wait_closed()
+
+    async def _serve(self, reader, writer):
+        self._connections[asyncio.current_task()] = writer
+        try:
+            while self._server.is_serving():
+                request_line = await reader.readline()
+                if not request_line:
+                    return
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get('content-length', 0))
+                if length > MAX_BODY_SIZE:
+                    await self._respond(writer, 413, b'', 'text/plain', close=True)
+                    return
+                body = await reader.readexactly(length) if length else b''
+
+                self._active += 1
+                self._idle.clear()
+                try:
+                    try:
+                        status, response, content_type = await self.handle(method, path, headers, body)
+                    except Exception as e:
+                        logging.error(f"HTTP: ошибка обработки {method} {path}: {e}")
+                        status, response, content_type = 500, b'', 'text/plain'
+                    close = headers.get('connection', '').lower() == 'close' or not self._server.is_serving()
+                    await self._respond(writer, status, response, content_type, close)
+                finally:
+                    self._active -= 1
+                    if not self._active:
+                        self._idle.set()
+                if close:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            del self._connections[asyncio.current_task()]
+            writer.close()
+
+    @staticmethod
+    async def _respond(writer, status, body, content_type, close=False):
+        writer.write(
+            f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'close' if close else 'keep-alive'}\r\n\r\n".encode('latin-1') + body
+        )
+        await writer.drain()
+
+class WebhookServer:
+    """Принимает обновления Telegram для нескольких ботов: путь /<имя бота>"""
+
+    def __init__(self, applications, secret, host=WEBHOOK_LISTEN, port=WEBHOOK_PORT):
+        self.applications = applications
+        self.secret = secret
+        self.http = HTTPServer(self._handle, host, port)
+
+    async def _handle(self, method, path, headers, body):
+        application = self.applications.get(path.strip('/').rpartition('/')[2])
+        if application is None:
+            return 404, b'', 'text/plain'
+        if method != 'POST':
+            return 405, b'', 'text/plain'
+        if not hmac.compare_digest(headers.get(SECRET_HEADER, ''), self.secret):
+            logging.warning(f"Webhook: запрос без верного секретного токена на {path}")
+            return 403, b'', 'text/plain'
+
+        try:
+            update = Update.de_json(json.loads(body), application.bot)
+        except (ValueError, KeyError, TypeError) as e:
+            logging.error(f"Webhook: некорректное обновление: {e}")
+            return 400, b'', 'text/plain'
+
+        # Обработка идет в приложении; Telegram получает ответ сразу
+        await application.update_queue.put(update)
+        return 200, b'', 'text/plain'
+
+    async def start(self):
+        await self.http.start()
+
+    async def stop(self):
+        await self.http.stop()
+
+async def start_applications(applications):
+    """Запускает приложения без run_polling, как это делает Application.run_webhook"""
+    for application in applications.values():
+        await application.initialize()
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+
+async def stop_applications(applications):
+    """Останавливает приложения: необработанные обновления из очереди обрабатываются до конца"""
+    for application in applications.values():
+        if application.running:
+            await application.stop()
+    for application in applications.values():
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+async def serve(applications, url=WEBHOOK_URL, secret=WEBHOOK_SECRET,
+                host=WEBHOOK_LISTEN, port=WEBHOOK_PORT, stop_event=None):
+    """Запускает ботов в режиме webhook и работает до SIGINT/SIGTERM или stop_event"""
+    if stop_event is None:
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop_event.set)
+
+    server = WebhookServer(applications, secret, host, port)
+    await start_applications(applications)
+    try:
+        await server.start()
+        try:
+            if url:
+                for name, application in applications.items():
+                    await application.bot.set_webhook(
+                        url=f"{url.rstrip('/')}/{name}",
+                        secret_token=secret,
+                        allowed_updates=Update.ALL_TYPES,
+                    )
+            logging.info(f"Webhook: слушаем {host}:{server.http.port}, боты: {', '.join(applications)}")
+
+            await stop_event.wait()
+            logging.info("Webhook: остановка")
+        finally:
+            # Сначала перестаем принимать запросы, затем дорабатываем принятые обновления
+            await server.stop()
+    finally:
+        await stop_applications(applications)
+
+def main():
+    if not WEBHOOK_URL or not WEBHOOK_SECRET:
+        raise SystemExit("Для режима webhook задайте WEBHOOK_URL и WEBHOOK_SECRET в secrets.py")
+
+    import resources
+    from run_bots import build_applications
+
+    applications = build_applications()
+    print("Боты запущены в режиме webhook...")
+    try:
+        asyncio.run(serve(applications))
+    finally:
+        resources.close()
+
+if __name__ == "__main__":
+    main()